@@ -1,58 +1,16 @@
 # Sección 1
 import streamlit as st
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import pandas as pd
-import io
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import json
-
-# --- Conexión a Google Sheets ---
-@st.cache_resource
-def conectar_hoja():
-    scope = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive"
-    ]
-    creds_dict = json.loads(st.secrets["GOOGLE_SHEETS_CREDENTIALS"])
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    cliente = gspread.authorize(creds)
-    hoja = cliente.open("CampiAsadosDB")
-    return hoja
-
-# Función para guardar un pedido en Google Sheets
-def guardar_pedido_sheets(pedido):
-    """Guarda el pedido en Google Sheets y retorna la fila guardada."""
-    try:
-        hoja = conectar_hoja()
-        hoja_pedidos = hoja.worksheet("Pedidos")
-        hoja_items = hoja.worksheet("Items")
-        # Agregar fila al sheet de Pedidos
-        hoja_pedidos.append_row([
-            pedido["id"],
-            pedido["tipo"],
-            pedido["mesa"] or "",
-            pedido["hora"],
-            pedido["estado"],
-            pedido["subtotal"],
-            pedido["propina"],
-            pedido["total"]
-        ])
-        # Agregar filas al sheet de Items
-        for item in pedido["productos"]:
-            hoja_items.append_row([
-                pedido["id"],
-                item["nombre"],
-                item["cantidad"],
-                item["obs"],
-                item["subtotal"]
-            ])
-        # Obtener y retornar la última fila ingresada
-        records = hoja_pedidos.get_all_records()
-        return records[-1] if records else None
-    except Exception as e:
-        st.error(f"Error al guardar en Google Sheets: {e}")
-        return None
+import copy
+import uuid
+from campi_datos import (
+    CATEGORIAS_POR_DEFECTO, Catalogo, FORMATOS_EXPORTACION, MESAS, PRODUCTOS_POR_DEFECTO,
+    agregados_ventas, cambiar_categoria_sheets, cargar_catalogo, cargar_frames_ventas,
+    detalle_ventas, eliminar_producto_sheets, exportar_reporte, guardar_producto_sheets,
+    importar_historial_sheets, obtener_almacen, obtener_cliente_sheets, obtener_cola_escritura,
+    obtener_perfilador, obtener_registro, obtener_sincronizador, resumenes_de_frames
+)
 
 # Configuración de página
 st.set_page_config(page_title="Campi Asados", layout="wide")
@@ -86,394 +44,511 @@ st.markdown("""
 # --- Encabezado ---
 st.image("logo_campi_asados.jpg", width=300)
 
+# --- Medición del rerun ---
+perfilador = obtener_perfilador()
+# Se conserva el rerun anterior: los botones que guardan y llaman st.rerun() no llegan al panel
+st.session_state.tramos_anteriores = st.session_state.get("tramos_rerun", [])
+st.session_state.tramos_rerun = perfilador.iniciar(rerun=datetime.now().strftime("%H:%M:%S.%f"))
+
 # --- Definición de categorías dinámicas ---
-# Cargar Productos y Categorías desde Google Sheets (si existen)
-try:
-    hoja = conectar_hoja()
-    prod_sheet = hoja.worksheet("Productos")
-    filas_prod = prod_sheet.get_all_records()
-    # Construir diccionario de productos
-    st.session_state.productos = {
-        fila["Nombre"]: {"precio": fila["Precio"], "descripcion": fila["Descripción"], "categoria": fila.get("Categoría")} 
-        for fila in filas_prod
-    }
-    # Lista de categorías única y ordenada
-    categories_list = sorted({fila.get("Categoría") for fila in filas_prod if fila.get("Categoría")})
-except Exception:
-    # Fallback estático
-    categories_list = [
-        "Carnes Especiales", "Carnes", "Chuzos", "Arepas", "Hamburguesas",
-        "Perros", "Otros Platos", "Bebidas", "Jugos", "Limonadas"
-    ]
-    if "productos" not in st.session_state:
-        st.session_state.productos = {
-            "punta de Anca con Champiñones": {"precio":20000, "descripcion":"Carne Asada, Papitas, arepa con lonchita, Ensalada", "categoria":"Carnes Especiales"},
-            "Solomito Especial": {"precio":50000, "descripcion":"Carne Asada, Papitas, arepa con lonchita, Ensalada", "categoria":"Carnes Especiales"},
-            "Punta de Anca": {"precio":15000, "descripcion":"Carne, papas, arepa", "categoria":"Carnes"},
-            "Chuzo de Pollo": {"precio":10000, "descripcion":"Chuzo, papas, arepa, Ensalada", "categoria":"Chuzos"},
-            "Arepa con Carne": {"precio":10000, "descripcion":"Carne desmechada y queso", "categoria":"Arepas"},
-            "Hamburguesa Especial": {"precio":10000, "descripcion":"Con todos los Juguetes", "categoria":"Hamburguesas"},
-            "Perro Grande Especial": {"precio":10000, "descripcion":"Ripio, Queso, Ensalada", "categoria":"Perros"},
-            "Picada para dos": {"precio":10000, "descripcion":"Picada de Chicharron, Papas, Morcilla, Carne, Maduritos", "categoria":"Otros Platos"},
-            "Cerveza": {"precio":5000, "descripcion":"Cerveza Fria", "categoria":"Bebidas"},
-            "Jugo de Mora": {"precio":10000, "descripcion":"Jugo Natural de Mora", "categoria":"Jugos"},
-            "Limonada de Mango": {"precio":5000, "descripcion":"Limonada de Mango", "categoria":"Limonadas"},
-            "Limonada de Coco": {"precio":5000, "descripcion":"Limonada de Coco", "categoria":"Limonadas"}
-        }
+# Cargar Productos y Categorías desde Google Sheets (si existen); la sesión solo
+# reconstruye su catálogo cuando cambia la revisión de Productos
+with perfilador.tramo("catálogo"):
+    try:
+        revision, productos, categorias = cargar_catalogo()
+        if st.session_state.get("catalogo_revision") != revision:
+            # Conservar solo las categorías creadas en esta sesión que aún no tienen productos;
+            # las que otro dispositivo renombró o eliminó desaparecen con la nueva revisión
+            sin_guardar = st.session_state.catalogo.sin_guardar() if "catalogo" in st.session_state else []
+            st.session_state.catalogo = Catalogo(productos, categorias, nuevas=sin_guardar)
+            st.session_state.catalogo_revision = revision
+    except Exception:
+        # Fallback estático
+        if "catalogo" not in st.session_state:
+            st.session_state.catalogo = Catalogo(copy.deepcopy(PRODUCTOS_POR_DEFECTO), CATEGORIAS_POR_DEFECTO)
+catalogo = st.session_state.catalogo
 # --- Estado de sesión ---
 
 # --- Prueba de conexión a Google Sheets ---
 if st.sidebar.button("🧪 Probar conexión Sheets"):
     try:
-        hoja_test = conectar_hoja()
-        pedidos_sheet = hoja_test.worksheet("Pedidos")
-        items_sheet = hoja_test.worksheet("Items")
+        sincronizador = obtener_sincronizador()
+        df_pedidos = sincronizador.sincronizar("Pedidos")
+        df_items   = sincronizador.sincronizar("Items")
         st.sidebar.success("✅ Conexión exitosa a CampiAsadosDB")
-        df_pedidos = pd.DataFrame(pedidos_sheet.get_all_records())
-        df_items   = pd.DataFrame(items_sheet.get_all_records())
+        st.sidebar.caption(
+            f"Filas nuevas leídas: {sincronizador.filas_nuevas['Pedidos']} pedidos, "
+            f"{sincronizador.filas_nuevas['Items']} ítems"
+        )
         st.sidebar.write("**Pedidos (primeras filas):**")
         st.sidebar.dataframe(df_pedidos.head())
         st.sidebar.write("**Items (primeras filas):**")
         st.sidebar.dataframe(df_items.head())
     except Exception as e:
         st.sidebar.error(f"Error al conectar: {e}")
-if "pedidos" not in st.session_state:
-    st.session_state.pedidos = []
-if "productos" not in st.session_state:
-    st.session_state.productos = {
-        "punta de Anca con Champiñones": {"precio":20000, "descripcion":"Carne Asada, Papitas, arepa con lonchita, Ensalada", "categoria":"Carnes Especiales"},
-        "Solomito Especial": {"precio":50000, "descripcion":"Carne Asada, Papitas, arepa con lonchita, Ensalada", "categoria":"Carnes Especiales"},
-        "Punta de Anca": {"precio":15000, "descripcion":"Carne, papas, arepa", "categoria":"Carnes"},
-        "Chuzo de Pollo": {"precio":10000, "descripcion":"Chuzo, papas, arepa, Ensalada", "categoria":"Chuzos"},
-        "Arepa con Carne": {"precio":10000, "descripcion":"Carne desmechada y queso", "categoria":"Arepas"},
-        "Hamburguesa Especial": {"precio":10000, "descripcion":"Con todos los Juguetes", "categoria":"Hamburguesas"},
-        "Perro Grande Especial": {"precio":10000, "descripcion":"Ripio, Queso, Ensalada", "categoria":"Perros"},
-        "Picada para dos": {"precio":10000, "descripcion":"Picada de Chicharron, Papas, Morcilla, Carne, Maduritos", "categoria":"Otros Platos"},
-        "Cerveza": {"precio":5000, "descripcion":"Cerveza Fria", "categoria":"Bebidas"},
-        "Jugo de Mora": {"precio":10000, "descripcion":"Jugo Natural de Mora", "categoria":"Jugos"},
-        "Limonada de Mango": {"precio":5000, "descripcion":"Limonada de Mango", "categoria":"Limonadas"},
-        "Limonada de Coco": {"precio":5000, "descripcion":"Limonada de Coco", "categoria":"Limonadas"}
-    }
+# --- Estado de la cola de escritura ---
+cola = obtener_cola_escritura()
+latencia = cola.latencia_promedio()
+st.sidebar.caption(
+    f"📤 Cola Sheets: {cola.profundidad()} pendientes · "
+    f"envío promedio: {f'{latencia * 1000:,.0f} ms' if latencia is not None else '—'} · "
+    f"cambios enviados: {cola.cambios_enviados}"
+)
+if cola.ultimo_error:
+    st.sidebar.warning(f"Reintentando envío a Sheets ({cola.reintentos} reintentos). {cola.ultimo_error}")
+with st.sidebar.expander("📶 Salud de Sheets"):
+    metricas = obtener_cliente_sheets().metricas()
+    formato_ms = lambda valor: f"{valor:,.0f} ms" if valor is not None else "—"
+    st.caption(
+        f"Estado: {metricas['estado']} · llamadas: {metricas['llamadas']} · "
+        f"429: {metricas['limites_cuota']} · errores: {metricas['errores']} · "
+        f"rechazadas: {metricas['rechazadas']} · reautorizaciones: {metricas['reautorizaciones']}"
+    )
+    st.caption(
+        f"Latencia p50: {formato_ms(metricas['p50'])} · p95: {formato_ms(metricas['p95'])} · "
+        f"p99: {formato_ms(metricas['p99'])}"
+    )
+almacen = obtener_almacen()
+registro = obtener_registro()
 if "inputs_reset" not in st.session_state:
     st.session_state.inputs_reset = False
+# Productos elegidos para el pedido en curso: nombre → {"cantidad", "obs"}
+if "seleccion_pedido" not in st.session_state:
+    st.session_state.seleccion_pedido = {}
+# Clave del pedido en curso: un doble clic en "Guardar pedido" no lo registra dos veces
+if "clave_pedido" not in st.session_state:
+    st.session_state.clave_pedido = uuid.uuid4().hex
 
 # Sección 2
 
 # --- Menú principal ---
-opciones_menu = ["📋 Tomar Pedido", "🛠️ Gestionar Productos", "📊 Reportes", "📂 Historial", "👨‍🍳 Pantalla Cocina"]
+opciones_menu = ["📋 Tomar Pedido", "🪑 Mesas", "🛠️ Gestionar Productos", "📊 Reportes", "📂 Historial", "👨‍🍳 Pantalla Cocina"]
 menu = st.sidebar.radio("Menú", opciones_menu)
 
 # --- Funciones auxiliares ---
+PEDIDOS_POR_PAGINA = 20
+
 def avanzar_estado(pedido):
-    estados = ["Registrado", "En preparación", "Entregado", "Pagado"]
-    idx = estados.index(pedido['estado'])
-    if idx < len(estados) - 1:
-        pedido['estado'] = estados[idx + 1]
+    return registro.avanzar_estado(pedido['id'])
 
 def mesa_ocupada(mesa):
-    return any(p['mesa'] == mesa and p['estado'] in ["Registrado", "En preparación", "Entregado"]
-               for p in st.session_state.pedidos)
+    return registro.mesa_ocupada(mesa)
 
-def agregar_pedido(tipo, mesa, productos):
-    subtotal = sum(item['subtotal'] for item in productos)
-    pedido = {
-        "id": len(st.session_state.pedidos) + 1,
-        "tipo": tipo,
-        "mesa": mesa if tipo == "Mesa" else None,
-        "productos": productos,
-        "estado": "Registrado",
-        "hora": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "subtotal": subtotal,
-        "propina": 0.0,
-        "total": subtotal
-    }
-    st.session_state.pedidos.append(pedido)
-    # Guardar en Google Sheets y mostrar confirmación
-    fila_sheet = guardar_pedido_sheets(pedido)
-    if fila_sheet:
-        st.success(f"✅ Pedido guardado en Sheets: {fila_sheet}")
+def agregar_pedido(tipo, mesa, productos, clave):
+    """Registra el pedido una sola vez por `clave` y lo encola para Sheets solo si es nuevo."""
+    with perfilador.tramo("agregar_pedido"):
+        subtotal = sum(item['subtotal'] for item in productos)
+        pedido = {
+            "id": None,
+            "tipo": tipo,
+            "mesa": mesa if tipo == "Mesa" else None,
+            "productos": productos,
+            "estado": "Registrado",
+            "hora": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "subtotal": subtotal,
+            "propina": 0.0,
+            "total": subtotal,
+            "clave": clave
+        }
+        pedido, nuevo = registro.crear_pedido(pedido)
+        # Encolar para Google Sheets; el envío ocurre en segundo plano
+        if nuevo:
+            obtener_cola_escritura().encolar(pedido)
+        return pedido
+
+def ticket_cocina(p):
+    """Texto del ticket de cocina de un pedido."""
+    header = f"### Pedido #{p['id']} - Mesa {p['mesa']}" if p['tipo']=='Mesa' else f"### Pedido #{p['id']} - {p['tipo']}"
+    lineas = "\n".join(f"- {pr['cantidad']}× **{pr['nombre']}** ({pr['obs']})" for pr in p['productos'])
+    return f"{header}\n\n🕒 {p['hora']}\n\n{lineas}\n\n**Total:** ${p['total']:,.2f}"
+
+@st.fragment(run_every=1)
+def tablero_cocina():
+    """Tickets en preparación; se refresca solo cada segundo sin redibujar la página.
+
+    Consulta al registro qué pedidos cambiaron desde la última versión vista y
+    reconstruye únicamente esos tickets.
+    """
+    version, cambiados = registro.cambios_desde(st.session_state.get("cocina_version", -1))
+    tickets = st.session_state.setdefault("cocina_tickets", {})
+    if cambiados is None:
+        tickets.clear()
+        tickets.update({p['id']: ticket_cocina(p) for p in registro.pedidos_por_estado("En preparación")})
     else:
-        st.warning("⚠️ El pedido se registró localmente, pero hubo problema al almacenar en Sheets.")
-    subtotal = sum(item['subtotal'] for item in productos)
-    pedido = {
-        "id": len(st.session_state.pedidos) + 1,
-        "tipo": tipo,
-        "mesa": mesa if tipo == "Mesa" else None,
-        "productos": productos,
-        "estado": "Registrado",
-        "hora": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "subtotal": subtotal,
-        "propina": 0.0,
-        "total": subtotal
-    }
-    st.session_state.pedidos.append(pedido)
-    # Guardar en Google Sheets
-    guardar_pedido_sheets(pedido)
+        for pedido_id in cambiados:
+            p = registro.obtener(pedido_id)
+            if p and p['estado'] == "En preparación":
+                tickets[pedido_id] = ticket_cocina(p)
+            else:
+                tickets.pop(pedido_id, None)
+    st.session_state.cocina_version = version
+    if tickets:
+        for pedido_id in sorted(tickets):
+            with st.container(key=f"ticket_{pedido_id}"):
+                st.markdown(tickets[pedido_id])
+                st.markdown("---")
+    else:
+        st.info("No hay pedidos en preparación.")
+
+COLUMNAS_MAPA = 5
+
+@st.fragment(run_every=10)
+def mapa_mesas():
+    """Mapa de las mesas con ocupación, total acumulado y tiempo desde el primer pedido.
+
+    Cada mesa se arma con el índice por mesa del registro, sin recorrer los
+    pedidos; se refresca sola para que los minutos avancen.
+    """
+    ahora = datetime.now()
+    resumen = registro.estado_mesas()
+    ocupadas = sum(1 for m in resumen if m["pedidos"])
+    st.caption(f"{ocupadas} de {len(resumen)} mesas ocupadas")
+    for inicio in range(0, len(resumen), COLUMNAS_MAPA):
+        for col, m in zip(st.columns(COLUMNAS_MAPA), resumen[inicio:inicio + COLUMNAS_MAPA]):
+            with col.container(border=True):
+                if m["pedidos"]:
+                    minutos = int((ahora - datetime.strptime(m["desde"], "%Y-%m-%d %H:%M:%S")).total_seconds() // 60)
+                    st.markdown(f"🔴 **Mesa {m['mesa']}**")
+                    st.caption(f"{m['estado']} · {minutos} min")
+                    st.markdown(f"${m['total']:,.0f}" + (f" · {m['pedidos']} pedidos" if m["pedidos"] > 1 else ""))
+                else:
+                    st.markdown(f"🟢 **Mesa {m['mesa']}**")
+                    st.caption("Libre")
+
+def actualizar_seleccion(nombre):
+    """Copia los campos del producto a la selección del pedido en curso."""
+    cantidad = st.session_state[f"cant_{nombre}"]
+    if cantidad > 0:
+        st.session_state.seleccion_pedido[nombre] = {"cantidad": cantidad, "obs": st.session_state[f"obs_{nombre}"]}
+    else:
+        st.session_state.seleccion_pedido.pop(nombre, None)
 
 # Sección 3
-if menu == "📋 Tomar Pedido":
-    # --- Página: Tomar Pedido ---
-    st.subheader("📝 Nuevo Pedido")
-    tipo = st.selectbox("Tipo de pedido", ["Mesa", "Para llevar", "Domicilio"])
-    mesa = st.selectbox("Número de mesa", [str(i) for i in range(1, 21)]) if tipo == "Mesa" else None
-    st.markdown("---")
-    st.write("### Selección de productos por categoría")
-    seleccion = []
-    for cat in categories_list:
-        with st.expander(cat, expanded=False):
-            for nombre, info in st.session_state.productos.items():
-                if info['categoria'] == cat:
-                    c1, c2 = st.columns([6, 4])
-                    c1.markdown(f"**{nombre}** — ${info['precio']:,.0f}")
-                    c1.markdown(f"_Desc:_ {info['descripcion']}")
-                    key_c, key_o = f"cant_{nombre}", f"obs_{nombre}"
-                    if st.session_state.inputs_reset:
-                        st.session_state[key_c], st.session_state[key_o] = 0, ''
-                    cantidad = c2.number_input(f"Cantidad - {nombre}", 0, 20, key=key_c)
-                    obs = c2.text_input(f"Observación - {nombre}", key=key_o)
-                    if cantidad > 0:
-                        seleccion.append({
-                            "nombre": nombre,
-                            "cantidad": cantidad,
-                            "obs": obs,
-                            "subtotal": cantidad * info['precio']
-                        })
-    if st.button("Guardar pedido"):
-        if tipo == "Mesa" and mesa and mesa_ocupada(mesa):
-            st.error("⚠️ Mesa ocupada; elige otra.")
-        elif seleccion:
-            agregar_pedido(tipo, mesa, seleccion)
-            st.success("✅ Pedido registrado exitosamente.")
-            st.session_state.inputs_reset = True
-            st.rerun()
+with perfilador.tramo(f"página {menu}"):
+    if menu == "📋 Tomar Pedido":
+        # --- Página: Tomar Pedido ---
+        st.subheader("📝 Nuevo Pedido")
+        tipo = st.selectbox("Tipo de pedido", ["Mesa", "Para llevar", "Domicilio"])
+        mesa = st.selectbox(
+            "Número de mesa", MESAS, format_func=lambda m: f"{m} (ocupada)" if mesa_ocupada(m) else m
+        ) if tipo == "Mesa" else None
+        st.markdown("---")
+        st.write("### Selección de productos por categoría")
+        # Solo se crean los campos de la categoría abierta (o de la búsqueda); lo elegido
+        # en otras categorías se conserva en st.session_state.seleccion_pedido
+        if st.session_state.inputs_reset:
+            st.session_state.buscar_producto = ''
+        busqueda = st.text_input("🔎 Buscar producto", key="buscar_producto")
+        if busqueda:
+            visibles = catalogo.buscar(busqueda)
         else:
-            st.error("⚠️ Selecciona al menos un producto.")
-    st.session_state.inputs_reset = False
+            cat = st.radio("Categoría", catalogo.categorias, horizontal=True, key="cat_pedido")
+            visibles = catalogo.productos_de(cat)
+        for nombre, info in visibles.items():
+            c1, c2 = st.columns([6, 4])
+            c1.markdown(f"**{nombre}** — ${info['precio']:,.0f}")
+            c1.markdown(f"_Desc:_ {info['descripcion']}")
+            key_c, key_o = f"cant_{nombre}", f"obs_{nombre}"
+            if st.session_state.inputs_reset or key_c not in st.session_state:
+                elegido = st.session_state.seleccion_pedido.get(nombre, {})
+                st.session_state[key_c], st.session_state[key_o] = elegido.get("cantidad", 0), elegido.get("obs", '')
+            c2.number_input(f"Cantidad - {nombre}", 0, 20, key=key_c, on_change=actualizar_seleccion, args=(nombre,))
+            c2.text_input(f"Observación - {nombre}", key=key_o, on_change=actualizar_seleccion, args=(nombre,))
+        if not visibles:
+            st.write("Sin productos.")
+        seleccion = [
+            {
+                "nombre": nombre,
+                "cantidad": elegido["cantidad"],
+                "obs": elegido["obs"],
+                "subtotal": elegido["cantidad"] * catalogo.productos[nombre]['precio']
+            }
+            for nombre, elegido in st.session_state.seleccion_pedido.items() if nombre in catalogo.productos
+        ]
+        if seleccion:
+            st.write("#### 🧾 Pedido en curso")
+            for item in seleccion:
+                st.markdown(f"- {item['cantidad']}× {item['nombre']} ({item['obs']}) — ${item['subtotal']:,.0f}")
+        if st.button("Guardar pedido"):
+            # Un segundo toque de un pedido que ya quedó guardado no debe chocar con su propia mesa
+            ya_guardado = almacen.existe_clave(st.session_state.clave_pedido)
+            if not ya_guardado and tipo == "Mesa" and mesa and mesa_ocupada(mesa):
+                st.error("⚠️ Mesa ocupada; elige otra.")
+            elif ya_guardado or seleccion:
+                if not ya_guardado:
+                    agregar_pedido(tipo, mesa, seleccion, st.session_state.clave_pedido)
+                # Renovar la clave antes de cualquier st.*: Streamlit puede cortar el script en esa llamada
+                st.session_state.clave_pedido = uuid.uuid4().hex
+                st.session_state.seleccion_pedido = {}
+                st.session_state.inputs_reset = True
+                st.success("✅ Pedido registrado exitosamente.")
+                st.rerun()
+            else:
+                st.error("⚠️ Selecciona al menos un producto.")
+        st.session_state.inputs_reset = False
 
-    # --- Pedidos Activos ---
-    st.markdown("---")
-    estados_activos = {
-        "Registrado": "📋 Pedidos Registrados", "En preparación": "🍳 Pedidos En preparación",  "Entregado": "📦 Pedidos Entregados"
-    }
-    for estado_key, titulo in estados_activos.items():
-        with st.expander(titulo, expanded=True):
-            lista = [p for p in st.session_state.pedidos if p['estado'] == estado_key]
-            if lista:
-                for p in lista:
-                    header = f"**#{p['id']}** - Mesa {p['mesa']}" if p['tipo'] == 'Mesa' else f"**#{p['id']}** - {p['tipo']}"
-                    cols = st.columns([2, 1, 1]) if estado_key in ["Registrado", "Entregado"] else st.columns([2, 1])
-                    cols[0].markdown(header)
-                    if estado_key in ["Registrado", "Entregado"]:
-                        cols[1].markdown(f"_Subtotal:_ ${p['subtotal']:,.2f}")
-                        tip_col = cols[2]
-                        if p['propina'] == 0.0:
-                            default_tip = round(p['subtotal'] * 0.1, 2)
-                            use_def = tip_col.checkbox(f"Propina 10% (${default_tip:,.2f})", key=f"tip_{estado_key}_{p['id']}")
-                            tip_val = default_tip if use_def else 0.0
-                            tip_val = tip_col.number_input("Otro valor", 0.0, value=tip_val, format="%.2f", key=f"tipcus_{estado_key}_{p['id']}")
-                            if tip_col.button("Aplicar", key=f"apply_{estado_key}_{p['id']}"):
-                                p['propina'] = round(tip_val, 2)
-                                p['total'] = round(p['subtotal'] + p['propina'], 2)
+        # --- Pedidos Activos ---
+        st.markdown("---")
+        estados_activos = {
+            "Registrado": "📋 Pedidos Registrados", "En preparación": "🍳 Pedidos En preparación",  "Entregado": "📦 Pedidos Entregados"
+        }
+        for estado_key, titulo in estados_activos.items():
+            with st.expander(titulo, expanded=True):
+                lista = registro.pedidos_por_estado(estado_key)
+                if lista:
+                    for p in lista:
+                        header = f"**#{p['id']}** - Mesa {p['mesa']}" if p['tipo'] == 'Mesa' else f"**#{p['id']}** - {p['tipo']}"
+                        cols = st.columns([2, 1, 1]) if estado_key in ["Registrado", "Entregado"] else st.columns([2, 1])
+                        cols[0].markdown(header)
+                        if estado_key in ["Registrado", "Entregado"]:
+                            cols[1].markdown(f"_Subtotal:_ ${p['subtotal']:,.2f}")
+                            tip_col = cols[2]
+                            if p['propina'] == 0.0:
+                                default_tip = round(p['subtotal'] * 0.1, 2)
+                                use_def = tip_col.checkbox(f"Propina 10% (${default_tip:,.2f})", key=f"tip_{estado_key}_{p['id']}")
+                                tip_val = default_tip if use_def else 0.0
+                                tip_val = tip_col.number_input("Otro valor", 0.0, value=tip_val, format="%.2f", key=f"tipcus_{estado_key}_{p['id']}")
+                                if tip_col.button("Aplicar", key=f"apply_{estado_key}_{p['id']}"):
+                                    registro.aplicar_propina(p['id'], tip_val)
+                                    st.rerun()
+                            else:
+                                tip_col.markdown(f"_Propina:_ ${p['propina']:,.2f}")
+                            st.markdown(f"**Total:** ${p['total']:,.2f}")
+                        for pr in p['productos']:
+                            suffix = f" — ${pr['subtotal']:,.2f}" if estado_key in ['Registrado','Entregado'] else ''
+                            st.markdown(f"- {pr['cantidad']}× {pr['nombre']} ({pr['obs']}){suffix}")
+                        action_col, time_col = st.columns([1, 4])
+                        with action_col:
+                            if p['estado'] in ["Registrado", "En preparación", "Entregado"]:
+                                if st.button(f"➕ Agregar producto #{p['id']}", key=f"addprod_{p['id']}"):
+                                    st.session_state[f"edit_order_{p['id']}"] = True
+                            if p['estado'] == "Registrado":
+                                if st.button(f"🗑️ Eliminar producto #{p['id']}", key=f"delprod_{p['id']}"):
+                                    st.session_state[f"del_menu_{p['id']}"] = True
+                            if p['estado'] != "Pagado":
+                                if st.button(f"▶️ Avanzar #{p['id']}", key=f"adv_{p['id']}"):
+                                    p = avanzar_estado(p) or p
+                                    st.success(f"Pedido #{p['id']} ahora {p['estado']}")
+                                    st.rerun()
+                        with time_col:
+                            time_col.markdown(f"🕒 {p['hora']}")
+                        if st.session_state.get(f"edit_order_{p['id']}"):
+                            st.markdown("---")
+                            st.write("### Añadir Producto")
+                            prod = st.selectbox("Producto", list(catalogo.productos), key=f"sel_{p['id']}")
+                            qty = st.number_input("Cantidad", 1, 20, key=f"qty_{p['id']}")
+                            obs = st.text_input("Observación", key=f"obs_add_{p['id']}")
+                            if st.button(f"Agregar a pedido #{p['id']}", key=f"conf_add_{p['id']}"):
+                                info = catalogo.productos[prod]
+                                new_item = {"nombre": prod, "cantidad": qty, "obs": obs, "subtotal": qty * info['precio']}
+                                registro.agregar_producto(p['id'], new_item)
+                                st.success("Producto agregado.")
+                                st.session_state[f"edit_order_{p['id']}"] = False
                                 st.rerun()
-                        else:
-                            tip_col.markdown(f"_Propina:_ ${p['propina']:,.2f}")
-                        st.markdown(f"**Total:** ${p['total']:,.2f}")
-                    for pr in p['productos']:
-                        suffix = f" — ${pr['subtotal']:,.2f}" if estado_key in ['Registrado','Entregado'] else ''
-                        st.markdown(f"- {pr['cantidad']}× {pr['nombre']} ({pr['obs']}){suffix}")
-                    action_col, time_col = st.columns([1, 4])
-                    with action_col:
-                        if p['estado'] in ["Registrado", "En preparación", "Entregado"]:
-                            if st.button(f"➕ Agregar producto #{p['id']}", key=f"addprod_{p['id']}"):
-                                st.session_state[f"edit_order_{p['id']}"] = True
-                        if p['estado'] == "Registrado":
-                            if st.button(f"🗑️ Eliminar producto #{p['id']}", key=f"delprod_{p['id']}"):
-                                st.session_state[f"del_menu_{p['id']}"] = True
-                        if p['estado'] != "Pagado":
-                            if st.button(f"▶️ Avanzar #{p['id']}", key=f"adv_{p['id']}"):
-                                avanzar_estado(p)
-                                st.success(f"Pedido #{p['id']} ahora {p['estado']}")
+                        if st.session_state.get(f"del_menu_{p['id']}"):
+                            st.markdown("---")
+                            st.write("### Eliminar Productos por Cantidad")
+                            options = [f"{idx+1}. {item['nombre']} (Cantidad: {item['cantidad']})" for idx, item in enumerate(p['productos'])]
+                            selected = st.selectbox("Selecciona el producto", options, key=f"sel_del_{p['id']}")
+                            sel_idx = int(selected.split(".")[0]) - 1
+                            prod_to_del = p['productos'][sel_idx]
+                            max_qty = prod_to_del['cantidad']
+                            qty_to_remove = st.number_input("Cantidad a eliminar", min_value=1, max_value=max_qty, value=1, step=1, key=f"qty_del_{p['id']}")
+                            if st.button(f"Eliminar cantidad #{p['id']}", key=f"conf_del_{p['id']}"):
+                                name = prod_to_del['nombre']
+                                price = catalogo.productos[name]['precio']
+                                if registro.eliminar_cantidad(p['id'], sel_idx, name, qty_to_remove, price) is None:
+                                    st.warning("⚠️ El pedido cambió en otro dispositivo; revisa e intenta de nuevo.")
+                                else:
+                                    st.success(f"Se eliminaron {qty_to_remove}× {name}.")
+                                st.session_state[f"del_menu_{p['id']}"] = False
                                 st.rerun()
-                    with time_col:
-                        time_col.markdown(f"🕒 {p['hora']}")
-                    if st.session_state.get(f"edit_order_{p['id']}"):
-                        st.markdown("---")
-                        st.write("### Añadir Producto")
-                        prod = st.selectbox("Producto", list(st.session_state.productos.keys()), key=f"sel_{p['id']}")
-                        qty = st.number_input("Cantidad", 1, 20, key=f"qty_{p['id']}")
-                        obs = st.text_input("Observación", key=f"obs_add_{p['id']}")
-                        if st.button(f"Agregar a pedido #{p['id']}", key=f"conf_add_{p['id']}"):
-                            info = st.session_state.productos[prod]
-                            new_item = {"nombre": prod, "cantidad": qty, "obs": obs, "subtotal": qty * info['precio']}
-                            p['productos'].append(new_item)
-                            p['subtotal'] = sum(x['subtotal'] for x in p['productos'])
-                            p['total'] = p['subtotal'] + p['propina']
-                            st.success("Producto agregado.")
-                            st.session_state[f"edit_order_{p['id']}"] = False
-                            st.rerun()
-                    if st.session_state.get(f"del_menu_{p['id']}"):
-                        st.markdown("---")
-                        st.write("### Eliminar Productos por Cantidad")
-                        options = [f"{idx+1}. {item['nombre']} (Cantidad: {item['cantidad']})" for idx, item in enumerate(p['productos'])]
-                        selected = st.selectbox("Selecciona el producto", options, key=f"sel_del_{p['id']}")
-                        sel_idx = int(selected.split(".")[0]) - 1
-                        prod_to_del = p['productos'][sel_idx]
-                        max_qty = prod_to_del['cantidad']
-                        qty_to_remove = st.number_input("Cantidad a eliminar", min_value=1, max_value=max_qty, value=1, step=1, key=f"qty_del_{p['id']}")
-                        if st.button(f"Eliminar cantidad #{p['id']}", key=f"conf_del_{p['id']}"):
-                            name = prod_to_del['nombre']
-                            price = st.session_state.productos[name]['precio']
-                            prod_to_del['cantidad'] -= qty_to_remove
-                            if prod_to_del['cantidad'] <= 0:
-                                p['productos'].pop(sel_idx)
-                            else:
-                                prod_to_del['subtotal'] = prod_to_del['cantidad'] * price
-                            p['subtotal'] = sum(item['subtotal'] for item in p['productos'])
-                            p['total'] = p['subtotal'] + p['propina']
-                            st.success(f"Se eliminaron {qty_to_remove}× {name}.")
-                            st.session_state[f"del_menu_{p['id']}"] = False
-                            st.rerun()
-            else:
-                st.write(f"No hay pedidos en estado {estado_key}.")
+                else:
+                    st.write(f"No hay pedidos en estado {estado_key}.")
 
-# --- Página: Gestionar Productos ---
-elif menu == "🛠️ Gestionar Productos":
-    st.subheader("🛒 Gestionar Productos y Categorías")
-    # Crear producto
-    with st.form("form_producto"):
-        n = st.text_input("Nombre")
-        p_val = st.number_input("Precio", 0, step=500)
-        d = st.text_input("Descripción")
-        c = st.selectbox("Categoría", categories_list)
-        if st.form_submit_button("Agregar Producto") and n:
-            st.session_state.productos[n] = {"precio": p_val, "descripcion": d, "categoria": c}
-            st.success(f"Producto '{n}' agregado.")
-            st.rerun()
-    st.markdown("---")
-    # Editar o eliminar producto
-    prod_sel = st.selectbox("Seleccionar producto", list(st.session_state.productos.keys()))
-    if prod_sel:
-        info = st.session_state.productos[prod_sel]
-        new_name = st.text_input("Nombre", value=prod_sel)
-        new_price = st.number_input("Precio", value=info["precio"], step=500)
-        new_desc = st.text_input("Descripción", value=info["descripcion"])
-        new_cat = st.selectbox("Categoría", categories_list, index=categories_list.index(info["categoria"]))
-        if st.button("Actualizar Producto"):
-            if new_name != prod_sel:
-                st.session_state.productos.pop(prod_sel)
-            st.session_state.productos[new_name] = {"precio": new_price, "descripcion": new_desc, "categoria": new_cat}
-            st.success("Producto actualizado.")
-            st.rerun()
-        if st.button("Eliminar Producto"):
-            st.session_state.productos.pop(prod_sel)
-            st.success("Producto eliminado.")
-            st.rerun()
-    st.markdown("---")
-    # Gestionar categorías
-    st.subheader("🏷️ Gestionar Categorías")
-    with st.form("form_categoria"):
-        new_cat = st.text_input("Nueva categoría")
-        if st.form_submit_button("Agregar Categoría") and new_cat:
-            categories_list.append(new_cat)
-            st.success(f"Categoría '{new_cat}' agregada.")
-            st.rerun()
-    cat_sel = st.selectbox("Seleccionar categoría", categories_list)
-    if cat_sel:
-        rename_cat = st.text_input("Renombrar categoría", value=cat_sel)
-        if st.button("Actualizar Categoría"):
-            idx = categories_list.index(cat_sel)
-            categories_list[idx] = rename_cat
-            for prod in st.session_state.productos.values():
-                if prod["categoria"] == cat_sel:
-                    prod["categoria"] = rename_cat
-            st.success("Categoría actualizada.")
-            st.rerun()
-        if st.button("EliminarCategoría"):
-            categories_list.remove(cat_sel)
-            for prod in st.session_state.productos.values():
-                if prod["categoria"] == cat_sel:
-                    prod["categoria"] = None
-            st.success("Categoría eliminada.")
-            st.rerun()
-    st.markdown("---")
-    st.write("### Productos actuales por categoría")
-    for cat in categories_list:
-        with st.expander(cat, expanded=False):
-            items = [n for n, v in st.session_state.productos.items() if v['categoria'] == cat]
-            if items:
-                for nombre in items:
-                    info = st.session_state.productos[nombre]
-                    st.markdown(f"- **{nombre}** — ${info['precio']:,.2f}")
-            else:
-                st.write("Sin productos.")
+    # --- Página: Gestionar Productos ---
+    elif menu == "🛠️ Gestionar Productos":
+        st.subheader("🛒 Gestionar Productos y Categorías")
+        # Crear producto
+        with st.form("form_producto"):
+            n = st.text_input("Nombre")
+            p_val = st.number_input("Precio", 0, step=500)
+            d = st.text_input("Descripción")
+            c = st.selectbox("Categoría", catalogo.categorias)
+            if st.form_submit_button("Agregar Producto") and n:
+                catalogo.agregar_producto(n, {"precio": p_val, "descripcion": d, "categoria": c})
+                guardar_producto_sheets(n, catalogo.productos[n])
+                st.success(f"Producto '{n}' agregado.")
+                st.rerun()
+        st.markdown("---")
+        # Editar o eliminar producto
+        prod_sel = st.selectbox("Seleccionar producto", list(catalogo.productos))
+        if prod_sel:
+            info = catalogo.productos[prod_sel]
+            new_name = st.text_input("Nombre", value=prod_sel)
+            new_price = st.number_input("Precio", value=info["precio"], step=500)
+            new_desc = st.text_input("Descripción", value=info["descripcion"])
+            cat_idx = catalogo.categorias.index(info["categoria"]) if info["categoria"] in catalogo.categorias else 0
+            new_cat = st.selectbox("Categoría", catalogo.categorias, index=cat_idx)
+            if st.button("Actualizar Producto"):
+                catalogo.actualizar_producto(prod_sel, new_name, {"precio": new_price, "descripcion": new_desc, "categoria": new_cat})
+                guardar_producto_sheets(new_name, catalogo.productos[new_name], nombre_anterior=prod_sel)
+                st.success("Producto actualizado.")
+                st.rerun()
+            if st.button("Eliminar Producto"):
+                catalogo.eliminar_producto(prod_sel)
+                eliminar_producto_sheets(prod_sel)
+                st.success("Producto eliminado.")
+                st.rerun()
+        st.markdown("---")
+        # Gestionar categorías
+        st.subheader("🏷️ Gestionar Categorías")
+        with st.form("form_categoria"):
+            new_cat = st.text_input("Nueva categoría")
+            if st.form_submit_button("Agregar Categoría") and new_cat:
+                catalogo.agregar_categoria(new_cat)
+                st.success(f"Categoría '{new_cat}' agregada.")
+                st.rerun()
+        cat_sel = st.selectbox("Seleccionar categoría", catalogo.categorias)
+        if cat_sel:
+            rename_cat = st.text_input("Renombrar categoría", value=cat_sel)
+            if st.button("Actualizar Categoría"):
+                if not rename_cat.strip():
+                    st.error("⚠️ Escribe un nombre para la categoría.")
+                elif catalogo.renombrar_categoria(cat_sel, rename_cat):
+                    cambiar_categoria_sheets(cat_sel, rename_cat)
+                    st.success("Categoría actualizada.")
+                    st.rerun()
+            if st.button("EliminarCategoría"):
+                catalogo.eliminar_categoria(cat_sel)
+                cambiar_categoria_sheets(cat_sel, None)
+                st.success("Categoría eliminada.")
+                st.rerun()
+        st.markdown("---")
+        st.write("### Productos actuales por categoría")
+        for cat in catalogo.categorias:
+            with st.expander(cat, expanded=False):
+                items = catalogo.productos_de(cat)
+                if items:
+                    for nombre, info in items.items():
+                        st.markdown(f"- **{nombre}** — ${info['precio']:,.2f}")
+                else:
+                    st.write("Sin productos.")
 
-# Sección 4
-# --- Página: Reportes ---
-elif menu == "📊 Reportes":
-    st.subheader("📈 Reportes de ventas")
-    pedidos = st.session_state.pedidos
-    if pedidos:
-        fechas = [datetime.strptime(p['hora'], "%Y-%m-%d %H:%M:%S").date() for p in pedidos]
-        min_fecha, max_fecha = min(fechas), max(fechas)
-        st.write("#### Filtrar por rango de fechas")
-        desde = st.date_input("Fecha desde", min_fecha)
-        hasta = st.date_input("Fecha hasta", max_fecha)
-        filtrados = [p for p in pedidos if desde <= datetime.strptime(p['hora'], "%Y-%m-%d %H:%M:%S").date() <= hasta]
-        detalle = []
-        for pdx in filtrados:
-            for pr in pdx['productos']:
-                detalle.append({
-                    'Fecha_Venta': pdx['hora'], 'Tipo': pdx['tipo'], 'Estado': pdx['estado'], 'Id_pedido': pdx['id'],
-                    'Producto': pr['nombre'], 'Valor': pr['subtotal']
-                })
-        df_detalle = pd.DataFrame(detalle)
-        st.write("### Ventas detalladas por producto")
-        st.dataframe(df_detalle)
-        resumen = []
-        for pdx in filtrados:
-            resumen.append({
-                'Fecha_Venta': pdx['hora'], 'Tipo': pdx['tipo'], 'Estado': pdx['estado'], 'Id_pedido': pdx['id'],
-                'Subtotal': pdx['subtotal'], 'Propina': pdx['propina'], 'Total': pdx['total']
-            })
-        df_resumen = pd.DataFrame(resumen)
-        st.write("### Resumen de ventas por pedido")
-        st.dataframe(df_resumen)
-        buf = io.BytesIO()
-        with pd.ExcelWriter(buf, engine='xlsxwriter') as writer:
-            df_detalle.to_excel(writer, index=False, sheet_name='Detalle')
-            df_resumen.to_excel(writer, index=False, sheet_name='Resumen')
-        st.download_button("📥 Descargar reportes en Excel", data=buf.getvalue(), file_name="reportes_pedidos.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    else:
-        st.info("No hay pedidos para mostrar.")
+    # Sección 4
+    # --- Página: Reportes ---
+    elif menu == "📊 Reportes":
+        st.subheader("📈 Reportes de ventas")
+        rango = almacen.rango_fechas()
+        if rango:
+            min_fecha, max_fecha = rango
+            st.write("#### Filtrar por rango de fechas")
+            desde = st.date_input("Fecha desde", min_fecha)
+            hasta = st.date_input("Fecha hasta", max_fecha)
+            categorias = {nombre: info['categoria'] for nombre, info in catalogo.productos.items()}
+            # Días cerrados desde los resúmenes diarios; solo el día en curso se calcula con pedidos crudos
+            hoy = date.today()
+            with perfilador.tramo("reporte totales"):
+                partes = []
+                if desde < hoy:
+                    partes.append(almacen.leer_resumenes(desde, min(hasta, hoy - timedelta(days=1))))
+                if hasta >= hoy:
+                    partes.append(resumenes_de_frames(*cargar_frames_ventas(max(desde, hoy), hasta, almacen.version)))
+                agregados = agregados_ventas(partes, categorias) if partes else {}
+            st.write("### Totales")
+            if agregados:
+                for tab, df_agregado in zip(st.tabs(list(agregados)), agregados.values()):
+                    tab.dataframe(df_agregado)
+            if st.toggle("Ver detalle por pedido"):
+                with perfilador.tramo("reporte detalle"):
+                    df_pedidos, df_items = cargar_frames_ventas(desde, hasta, almacen.version)
+                    df_detalle = detalle_ventas(df_pedidos, df_items, categorias)
+                st.write("### Ventas detalladas por producto")
+                st.dataframe(df_detalle)
+                df_resumen = df_pedidos[["Fecha_Venta", "Tipo", "Estado", "Id_pedido", "Subtotal", "Propina", "Total"]]
+                st.write("### Resumen de ventas por pedido")
+                st.dataframe(df_resumen)
+            # El archivo se genera solo cuando se pide y se reutiliza mientras no cambien los datos
+            st.write("### Exportar")
+            formato = st.radio("Formato", list(FORMATOS_EXPORTACION), horizontal=True, key="formato_exportacion")
+            clave_exportacion = (desde, hasta, formato, almacen.version)
+            if st.button("📦 Preparar archivo"):
+                st.session_state.exportacion = clave_exportacion
+            if st.session_state.get("exportacion") == clave_exportacion:
+                nombre_archivo, mime = FORMATOS_EXPORTACION[formato]
+                with perfilador.tramo("reporte exportación", formato=formato):
+                    datos_exportacion = exportar_reporte(desde, hasta, formato, almacen.version, categorias)
+                st.download_button(
+                    f"📥 Descargar reportes en {formato}",
+                    data=datos_exportacion,
+                    file_name=nombre_archivo, mime=mime
+                )
+        else:
+            st.info("No hay pedidos para mostrar.")
 
-# --- Página: Historial ---
-elif menu == "📂 Historial":
-    st.subheader("📁 Historial de Pedidos Pagados")
-    pagados = [p for p in st.session_state.pedidos if p['estado'] == "Pagado"]
-    if pagados:
-        for p in pagados:
-            header = f"**#{p['id']}** - Mesa {p['mesa']}" if p['tipo']=='Mesa' else f"**#{p['id']}** - {p['tipo']}"
-            st.markdown(f"{header} - Total: ${p['total']:,.2f}")
-            for pr in p['productos']:
-                st.markdown(f"- {pr['cantidad']}× {pr['nombre']} ({pr['obs']}) — ${pr['subtotal']:,.2f}")
-            st.markdown("---")
-    else:
-        st.info("No hay pedidos pagados.")
+    # --- Página: Historial ---
+    elif menu == "📂 Historial":
+        st.subheader("📁 Historial de Pedidos Pagados")
+        # Filtros: la búsqueda y la paginación se resuelven en el almacén local
+        f1, f2, f3, f4, f5 = st.columns(5)
+        desde = f1.date_input("Desde", value=None, key="hist_desde")
+        hasta = f2.date_input("Hasta", value=None, key="hist_hasta")
+        mesa = f3.selectbox("Mesa", ["Todas"] + MESAS, key="hist_mesa")
+        tipo = f4.selectbox("Tipo", ["Todos", "Mesa", "Para llevar", "Domicilio"], key="hist_tipo")
+        producto = f5.text_input("Producto", key="hist_producto")
+        filtros = {
+            "desde": desde, "hasta": hasta, "producto": producto.strip() or None,
+            "mesa": None if mesa == "Todas" else mesa, "tipo": None if tipo == "Todos" else tipo
+        }
+        pagina = st.session_state.get("hist_pagina", 1)
+        total, pagados = almacen.consultar_historial(PEDIDOS_POR_PAGINA, (pagina - 1) * PEDIDOS_POR_PAGINA, **filtros)
+        paginas = max(1, -(-total // PEDIDOS_POR_PAGINA))
+        if pagina > paginas:
+            # Los filtros dejaron menos páginas: ir a la última
+            pagina = st.session_state.hist_pagina = paginas
+            total, pagados = almacen.consultar_historial(PEDIDOS_POR_PAGINA, (pagina - 1) * PEDIDOS_POR_PAGINA, **filtros)
+        st.number_input(f"Página (de {paginas})", 1, paginas, key="hist_pagina")
+        if pagados:
+            st.caption(f"{total} pedidos")
+            for p in pagados:
+                header = f"**#{p['id']}** - Mesa {p['mesa']}" if p['tipo']=='Mesa' else f"**#{p['id']}** - {p['tipo']}"
+                lineas = "\n".join(f"- {pr['cantidad']}× {pr['nombre']} ({pr['obs']}) — ${pr['subtotal']:,.2f}" for pr in p['productos'])
+                st.markdown(f"{header} - {p['hora']} - Total: ${p['total']:,.2f}\n\n{lineas}\n\n---")
+        else:
+            st.info("No hay pedidos pagados.")
+        if st.button("⏬ Cargar historial anterior desde Sheets"):
+            try:
+                importados = importar_historial_sheets()
+                if importados is None:
+                    st.info("Ya se cargó todo el historial de Sheets.")
+                else:
+                    st.success(f"Se importaron {importados} pedidos de Sheets.")
+            except Exception as e:
+                st.error(f"Error al leer Google Sheets: {e}")
+
+    # --- Página: Mesas ---
+    elif menu == "🪑 Mesas":
+        st.subheader("🪑 Mapa de mesas")
+        mapa_mesas()
 
-# --- Página: Pantalla Cocina ---
-elif menu == "👨‍🍳 Pantalla Cocina":
-    st.subheader("👨‍🍳 Pedidos en Cocina")
-    en_preparacion = [p for p in st.session_state.pedidos if p['estado'] == "En preparación"]
-    if en_preparacion:
-        for p in en_preparacion:
-            header = f"### Pedido #{p['id']} - Mesa {p['mesa']}" if p['tipo']=='Mesa' else f"### Pedido #{p['id']} - {p['tipo']}"
-            st.markdown(header)
-            st.markdown(f"🕒 {p['hora']}")
-            for pr in p['productos']:
-                st.markdown(f"- {pr['cantidad']}× **{pr['nombre']}** ({pr['obs']})")
-            st.markdown(f"**Total:** ${p['total']:,.2f}")
-            st.markdown("---")
+    # --- Página: Pantalla Cocina ---
+    elif menu == "👨‍🍳 Pantalla Cocina":
+        st.subheader("👨‍🍳 Pedidos en Cocina")
+        tablero_cocina()
         if st.button("🖨️ Imprimir Cocina"):
             st.info("Usa Ctrl+P para imprimir esta vista.")
-    else:
-        st.info("No hay pedidos en preparación.")
+
+# --- Panel de administración (oculto; se abre con ?admin=1) ---
+if st.query_params.get("admin") == "1":
+    with st.sidebar.expander("⏱️ Tiempos del rerun", expanded=True):
+        for titulo, tramos in [("Este rerun", perfilador.tramos()), ("Rerun anterior", st.session_state.tramos_anteriores)]:
+            st.write(f"**{titulo}**")
+            st.dataframe(
+                pd.DataFrame(
+                    [{"Tramo": "· " * t["nivel"] + t["tramo"], "ms": t["ms"]} for t in tramos],
+                    columns=["Tramo", "ms"]
+                ),
+                hide_index=True
+            )
+        if perfilador.ruta_log:
+            st.caption(f"Registro JSON lines: {perfilador.ruta_log}")
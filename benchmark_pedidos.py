@@ -0,0 +1,221 @@
+"""Mediciones de rendimiento de Campi Asados sin conexión a Google.
+
+Usa un almacén SQLite temporal y el libro de Sheets simulado de la app
+(CAMPI_SHEETS=memoria), con carga sintética: por defecto 500 pedidos por hora
+repartidos en 20 mesas, de 1 a 15 ítems por pedido. Reporta:
+
+- latencia de guardado de pedidos y tiempo hasta quedar sincronizados en Sheets;
+- tiempo de construcción de cada página del menú (con streamlit.testing);
+- tiempo de los reportes con 1.000, 10.000 y 100.000 pedidos históricos.
+
+Uso:
+    python benchmark_pedidos.py
+    python benchmark_pedidos.py --historicos 1000 10000 --latencia 0.3 --cuota 60
+    python benchmark_pedidos.py --omitir paginas
+"""
+import argparse
+import importlib
+import math
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+import streamlit as st
+
+import campi_datos
+
+RUTA_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Sistema_Pedidos_Campi_Asados.py")
+HORAS_SERVICIO = (12, 22)
+PAGINAS = ["📋 Tomar Pedido", "🪑 Mesas", "🛠️ Gestionar Productos", "📊 Reportes", "📂 Historial", "👨‍🍳 Pantalla Cocina"]
+
+
+def cargar_app(ruta_bd, latencia, cuota):
+    """Recarga campi_datos con un almacén propio y el Sheets simulado, y lo retorna."""
+    os.environ.update(
+        CAMPI_BD=ruta_bd, CAMPI_SHEETS="memoria",
+        CAMPI_SHEETS_LATENCIA=str(latencia), CAMPI_SHEETS_CUOTA=str(cuota or 0)
+    )
+    # Los singletons en caché son de la base anterior; RUTA_BD se lee al importar
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    return importlib.reload(campi_datos)
+
+
+def generar_pedido(app, azar, hora, mesas, estado):
+    """Un pedido sintético con 1 a 15 líneas del catálogo por defecto."""
+    tipo = azar.choices(["Mesa", "Para llevar", "Domicilio"], weights=[7, 2, 1])[0]
+    productos = []
+    # Las líneas pueden repetir producto, como al agregar más de algo a un pedido abierto
+    for nombre, info in azar.choices(list(app.PRODUCTOS_POR_DEFECTO.items()), k=azar.randint(1, 15)):
+        cantidad = azar.randint(1, 3)
+        productos.append({"nombre": nombre, "cantidad": cantidad, "obs": "", "subtotal": info["precio"] * cantidad})
+    subtotal = sum(item["subtotal"] for item in productos)
+    propina = round(subtotal * 0.1) if tipo == "Mesa" and azar.random() < 0.5 else 0.0
+    return {
+        "id": None, "tipo": tipo, "mesa": str(azar.randint(1, mesas)) if tipo == "Mesa" else None,
+        "productos": productos, "estado": estado, "hora": hora.strftime("%Y-%m-%d %H:%M:%S"),
+        "subtotal": subtotal, "propina": propina, "total": subtotal + propina
+    }
+
+
+def generar_historial(app, cantidad, por_hora, mesas, semilla=7):
+    """Pedidos pagados de días anteriores, a `por_hora` pedidos por hora de servicio."""
+    azar = random.Random(semilla)
+    por_dia = por_hora * (HORAS_SERVICIO[1] - HORAS_SERVICIO[0])
+    dia = date.today() - timedelta(days=math.ceil(cantidad / por_dia))
+    intervalo = 3600 / por_hora
+    for numero in range(cantidad):
+        dia_pedido = dia + timedelta(days=numero // por_dia)
+        hora = datetime.combine(dia_pedido, datetime.min.time()) + timedelta(
+            hours=HORAS_SERVICIO[0], seconds=(numero % por_dia) * intervalo
+        )
+        yield generar_pedido(app, azar, hora, mesas, "Pagado")
+
+
+def cargar_historial(app, cantidad, por_hora, mesas, bloque=5000):
+    """Guarda el historial sintético en el almacén por bloques, como una importación desde Sheets."""
+    almacen = app.obtener_almacen()
+    lote = []
+    for pedido in generar_historial(app, cantidad, por_hora, mesas):
+        lote.append(pedido)
+        if len(lote) == bloque:
+            almacen.importar_pedidos(lote, {})
+            lote = []
+    if lote:
+        almacen.importar_pedidos(lote, {})
+    return almacen
+
+
+def resumen_ms(tiempos):
+    """p50 / p95 / máximo en milisegundos."""
+    orden = sorted(tiempos)
+    p95 = orden[min(len(orden) - 1, int(0.95 * len(orden)))]
+    return f"p50 {statistics.median(orden) * 1000:,.2f} ms · p95 {p95 * 1000:,.2f} ms · máx {orden[-1] * 1000:,.2f} ms"
+
+
+def medir_guardado(args, directorio):
+    """Guarda pedidos como lo hace la página Tomar Pedido y espera a que la cola los envíe."""
+    app = cargar_app(os.path.join(directorio, "guardado.db"), args.latencia, args.cuota)
+    registro, cola = app.obtener_registro(), app.obtener_cola_escritura()
+    azar = random.Random(11)
+    tiempos = []
+    for _ in range(args.pedidos):
+        pedido = dict(generar_pedido(app, azar, datetime.now(), args.mesas, "Registrado"), clave=uuid.uuid4().hex)
+        inicio = time.perf_counter()
+        pedido, _ = registro.crear_pedido(pedido)
+        cola.encolar(pedido)
+        tiempos.append(time.perf_counter() - inicio)
+    inicio = time.perf_counter()
+    while cola.profundidad():
+        time.sleep(0.05)
+    sincronizacion = time.perf_counter() - inicio
+    metricas = app.obtener_cliente_sheets().metricas()
+    print(f"\n== Guardado de {args.pedidos} pedidos (Sheets simulado: {args.latencia} s por llamada) ==")
+    print(f"guardar (almacén + cola): {resumen_ms(tiempos)}")
+    print(
+        f"sincronización con Sheets: {sincronizacion:,.1f} s · llamadas {metricas['llamadas']} · "
+        f"429 {metricas['limites_cuota']} · p95 por llamada {metricas['p95'] or 0:,.0f} ms"
+    )
+
+
+def medir_paginas(args, directorio):
+    """Tiempo de construcción de cada página con un historial y una mesa activa por mesa."""
+    from streamlit.testing.v1 import AppTest
+
+    app = cargar_app(os.path.join(directorio, "paginas.db"), 0, None)
+    cargar_historial(app, args.historicos_paginas, args.por_hora, args.mesas)
+    registro = app.obtener_registro()
+    azar = random.Random(13)
+    for mesa in range(1, args.mesas + 1):
+        pedido = dict(generar_pedido(app, azar, datetime.now(), args.mesas, "Registrado"), tipo="Mesa", mesa=str(mesa))
+        pedido, _ = registro.crear_pedido(pedido)
+        if mesa % 2:
+            registro.avanzar_estado(pedido["id"])
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    prueba = AppTest.from_file(RUTA_APP, default_timeout=120)
+    prueba.run()
+    print(f"\n== Páginas ({args.historicos_paginas:,} pedidos históricos, {args.mesas} mesas activas) ==")
+    for pagina in PAGINAS:
+        prueba.sidebar.radio[0].set_value(pagina).run()
+        tiempos = []
+        for _ in range(args.repeticiones):
+            inicio = time.perf_counter()
+            prueba.run()
+            tiempos.append(time.perf_counter() - inicio)
+        if prueba.exception:
+            print(f"{pagina}: error {prueba.exception[0].message}")
+        else:
+            print(f"{pagina:<24} {statistics.median(tiempos) * 1000:>9,.1f} ms")
+
+
+def medir_reportes(args, directorio):
+    """Tiempo de totales, detalle y exportaciones sobre todo el historial, para cada tamaño."""
+    print("\n== Reportes ==")
+    print(f"{'pedidos':>9} {'carga':>9} {'totales':>9} {'detalle':>9} " + " ".join(f"{f:>9}" for f in ["Excel", "CSV", "Parquet"]))
+    for cantidad in args.historicos:
+        app = cargar_app(os.path.join(directorio, f"reportes_{cantidad}.db"), 0, None)
+        inicio = time.perf_counter()
+        almacen = cargar_historial(app, cantidad, args.por_hora, args.mesas)
+        carga = time.perf_counter() - inicio
+        desde, hasta = almacen.rango_fechas()
+        categorias = {nombre: info["categoria"] for nombre, info in app.PRODUCTOS_POR_DEFECTO.items()}
+
+        def totales():
+            app.agregados_ventas([almacen.leer_resumenes(desde, hasta)], categorias)
+
+        def detalle():
+            app.cargar_frames_ventas.clear()
+            app.detalle_ventas(*app.cargar_frames_ventas(desde, hasta, almacen.version), categorias)
+
+        def exportar(formato):
+            if formato not in app.FORMATOS_EXPORTACION:
+                return None
+
+            def generar():
+                app.exportar_reporte.clear()
+                app.exportar_reporte(desde, hasta, formato, almacen.version, categorias)
+            return generar
+
+        columnas = [carga]
+        for medir in [totales, detalle, exportar("Excel"), exportar("CSV"), exportar("Parquet")]:
+            if medir is None:
+                columnas.append(None)
+                continue
+            tiempos = []
+            for _ in range(args.repeticiones_reportes):
+                inicio = time.perf_counter()
+                medir()
+                tiempos.append(time.perf_counter() - inicio)
+            columnas.append(min(tiempos))
+        print(f"{cantidad:>9,} " + " ".join(f"{c:>8.2f}s" if c is not None else f"{'—':>9}" for c in columnas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pedidos", type=int, default=500, help="pedidos a guardar en la medición de guardado")
+    parser.add_argument("--por-hora", type=int, default=500, help="ritmo de pedidos por hora de servicio")
+    parser.add_argument("--mesas", type=int, default=20)
+    parser.add_argument("--historicos", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--historicos-paginas", type=int, default=10000)
+    parser.add_argument("--latencia", type=float, default=0.2, help="segundos por llamada al Sheets simulado")
+    parser.add_argument("--cuota", type=int, default=0, help="llamadas por minuto antes de responder 429 (0 = sin límite)")
+    parser.add_argument("--repeticiones", type=int, default=5, help="reruns por página")
+    parser.add_argument("--repeticiones-reportes", type=int, default=1)
+    parser.add_argument("--omitir", nargs="*", default=[], choices=["guardado", "paginas", "reportes"])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directorio:
+        if "guardado" not in args.omitir:
+            medir_guardado(args, directorio)
+        if "paginas" not in args.omitir:
+            medir_paginas(args, directorio)
+        if "reportes" not in args.omitir:
+            medir_reportes(args, directorio)
+
+
+if __name__ == "__main__":
+    main()
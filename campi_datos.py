@@ -0,0 +1,1903 @@
+"""Datos de Campi Asados, sin interfaz: almacén local de pedidos, registro compartido,
+conexión a Google Sheets (y su simulación en memoria), reportes y catálogo.
+
+Lo importan la app (Sistema_Pedidos_Campi_Asados.py) y benchmark_pedidos.py.
+"""
+import streamlit as st
+from datetime import datetime, timedelta
+import pandas as pd
+import io
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import copy
+import random
+from collections import deque
+from contextlib import contextmanager
+import zipfile
+import xlsxwriter
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet es opcional
+    pa = pq = None
+
+# --- Medición de tiempos ---
+class Perfilador:
+    """Mide tramos de tiempo (catálogo, página, guardado, llamadas a Sheets, reportes).
+
+    Cada hilo lleva su propia lista de tramos: la del hilo de la sesión se reinicia
+    en cada rerun y alimenta el panel de administración. Si se indica `ruta_log`,
+    cada tramo se agrega además como una línea JSON para analizarlo después.
+    """
+
+    def __init__(self, ruta_log=None):
+        self.ruta_log = ruta_log
+        self._local = threading.local()
+        self._lock_log = threading.Lock()
+
+    def iniciar(self, **datos):
+        """Comienza la medición de un rerun en el hilo actual y retorna su lista de tramos."""
+        self._local.tramos = []
+        self._local.nivel = 0
+        self._local.datos = datos
+        return self._local.tramos
+
+    def tramos(self):
+        """Tramos medidos en el rerun actual del hilo, en orden de inicio."""
+        return list(getattr(self._local, "tramos", []))
+
+    def abrir(self, nombre, **datos):
+        """Inicia un tramo y lo retorna; debe cerrarse con `cerrar`."""
+        nivel = getattr(self._local, "nivel", 0)
+        registro = {"tramo": nombre, "nivel": nivel, "ms": None, **datos, "_inicio": time.perf_counter()}
+        tramos = getattr(self._local, "tramos", None)
+        if tramos is not None:
+            tramos.append(registro)
+        self._local.nivel = nivel + 1
+        return registro
+
+    def cerrar(self, registro):
+        registro["ms"] = round((time.perf_counter() - registro.pop("_inicio")) * 1000, 2)
+        self._local.nivel = registro["nivel"]
+        if self.ruta_log:
+            linea = {
+                "ts": datetime.now().isoformat(timespec="milliseconds"),
+                "hilo": threading.current_thread().name,
+                **getattr(self._local, "datos", {}), **registro
+            }
+            with self._lock_log:
+                with open(self.ruta_log, "a", encoding="utf-8") as archivo:
+                    archivo.write(json.dumps(linea, ensure_ascii=False, default=str) + "\n")
+
+    @contextmanager
+    def tramo(self, nombre, **datos):
+        registro = self.abrir(nombre, **datos)
+        try:
+            yield registro
+        finally:
+            self.cerrar(registro)
+
+@st.cache_resource
+def obtener_perfilador():
+    """Perfilador único; el log JSON lines se activa con la variable CAMPI_PERFIL_LOG."""
+    return Perfilador(os.environ.get("CAMPI_PERFIL_LOG"))
+
+# --- Almacén local de pedidos (SQLite en modo WAL) ---
+RUTA_BD = os.environ.get("CAMPI_BD", os.path.join(os.path.dirname(os.path.abspath(__file__)), "campi_asados.db"))
+ESTADOS = ["Registrado", "En preparación", "Entregado", "Pagado"]
+ESTADOS_ACTIVOS = ["Registrado", "En preparación", "Entregado"]
+MESAS = [str(i) for i in range(1, 21)]
+
+class AlmacenPedidos:
+    """Diario local y durable de pedidos, ítems y cambios de estado.
+
+    Es la copia principal de los pedidos: sobrevive reinicios y es compartida por
+    todas las sesiones del proceso. Google Sheets se mantiene como réplica que se
+    sincroniza en segundo plano (columna `sincronizado`).
+    """
+
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS pedidos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            mesa TEXT,
+            hora TEXT NOT NULL,
+            estado TEXT NOT NULL,
+            subtotal REAL NOT NULL,
+            propina REAL NOT NULL DEFAULT 0,
+            total REAL NOT NULL,
+            sincronizado INTEGER NOT NULL DEFAULT 0,
+            importado INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS items (
+            pedido_id INTEGER NOT NULL REFERENCES pedidos(id),
+            posicion INTEGER NOT NULL,
+            nombre TEXT NOT NULL,
+            cantidad INTEGER NOT NULL,
+            obs TEXT NOT NULL DEFAULT '',
+            subtotal REAL NOT NULL,
+            PRIMARY KEY (pedido_id, posicion)
+        );
+        CREATE TABLE IF NOT EXISTS transiciones (
+            pedido_id INTEGER NOT NULL REFERENCES pedidos(id),
+            estado_anterior TEXT,
+            estado_nuevo TEXT NOT NULL,
+            hora TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS resumen_producto (
+            dia TEXT NOT NULL,
+            producto TEXT NOT NULL,
+            cantidad INTEGER NOT NULL,
+            ventas REAL NOT NULL,
+            PRIMARY KEY (dia, producto)
+        );
+        CREATE TABLE IF NOT EXISTS resumen_tipo (
+            dia TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            pedidos INTEGER NOT NULL,
+            subtotal REAL NOT NULL,
+            propina REAL NOT NULL,
+            total REAL NOT NULL,
+            PRIMARY KEY (dia, tipo)
+        );
+        CREATE TABLE IF NOT EXISTS resumen_hora (
+            dia TEXT NOT NULL,
+            hora INTEGER NOT NULL,
+            pedidos INTEGER NOT NULL,
+            total REAL NOT NULL,
+            PRIMARY KEY (dia, hora)
+        );
+        CREATE TABLE IF NOT EXISTS cursores_hojas (
+            hoja TEXT PRIMARY KEY,
+            ultima_fila INTEGER NOT NULL
+        );
+        -- Fila de Sheets de cada pedido (orden 0 en Pedidos) y de cada línea en Items
+        CREATE TABLE IF NOT EXISTS filas_sheets (
+            pedido_id INTEGER NOT NULL,
+            hoja TEXT NOT NULL,
+            orden INTEGER NOT NULL,
+            fila INTEGER NOT NULL,
+            PRIMARY KEY (pedido_id, hoja, orden)
+        );
+        -- Pedidos modificados cuyo estado actual aún no se ha enviado a Sheets
+        CREATE TABLE IF NOT EXISTS cambios_sheets (
+            pedido_id INTEGER PRIMARY KEY,
+            marca INTEGER NOT NULL
+        );
+    """
+
+    # Columnas agregadas después de la primera versión: (tabla, columna, definición)
+    COLUMNAS_NUEVAS = [
+        ("pedidos", "importado", "INTEGER NOT NULL DEFAULT 0"),
+        ("pedidos", "clave", "TEXT"),
+    ]
+
+    INDICES = """
+        CREATE INDEX IF NOT EXISTS idx_pedidos_estado ON pedidos(estado, id);
+        CREATE INDEX IF NOT EXISTS idx_pedidos_mesa ON pedidos(mesa, estado);
+        CREATE INDEX IF NOT EXISTS idx_pedidos_hora ON pedidos(hora);
+        CREATE INDEX IF NOT EXISTS idx_pedidos_pendientes ON pedidos(id) WHERE sincronizado = 0;
+        CREATE INDEX IF NOT EXISTS idx_pedidos_historial ON pedidos(hora) WHERE estado = 'Pagado' OR importado = 1;
+        CREATE INDEX IF NOT EXISTS idx_transiciones_pedido ON transiciones(pedido_id);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_pedidos_clave ON pedidos(clave) WHERE clave IS NOT NULL;
+    """
+
+    # Reconstrucción completa de los resúmenes diarios (bases creadas antes de existir)
+    RECONSTRUIR_RESUMENES = """
+        DELETE FROM resumen_producto;
+        DELETE FROM resumen_tipo;
+        DELETE FROM resumen_hora;
+        INSERT INTO resumen_producto (dia, producto, cantidad, ventas)
+            SELECT substr(p.hora, 1, 10), i.nombre, SUM(i.cantidad), SUM(i.subtotal)
+            FROM items i JOIN pedidos p ON p.id = i.pedido_id GROUP BY 1, 2;
+        INSERT INTO resumen_tipo (dia, tipo, pedidos, subtotal, propina, total)
+            SELECT substr(hora, 1, 10), tipo, COUNT(*), SUM(subtotal), SUM(propina), SUM(total)
+            FROM pedidos GROUP BY 1, 2;
+        INSERT INTO resumen_hora (dia, hora, pedidos, total)
+            SELECT substr(hora, 1, 10), CAST(substr(hora, 12, 2) AS INTEGER), COUNT(*), SUM(total)
+            FROM pedidos GROUP BY 1, 2;
+    """
+
+    def __init__(self, ruta=RUTA_BD):
+        self.ruta = ruta
+        # Una sola conexión compartida entre hilos, serializada con un lock
+        self._con = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._con.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        self._con.execute("PRAGMA foreign_keys=ON")
+        self._con.executescript(self.ESQUEMA)
+        for tabla, columna, definicion in self.COLUMNAS_NUEVAS:
+            existentes = {fila["name"] for fila in self._con.execute(f"PRAGMA table_info({tabla})")}
+            if columna not in existentes:
+                self._con.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}")
+        self._con.executescript(self.INDICES)
+        sin_resumen = self._con.execute(
+            "SELECT EXISTS (SELECT 1 FROM pedidos) AND NOT EXISTS (SELECT 1 FROM resumen_tipo)"
+        ).fetchone()[0]
+        if sin_resumen:
+            self._con.executescript(f"BEGIN; {self.RECONSTRUIR_RESUMENES} COMMIT;")
+        # Aumenta con cada escritura confirmada de pedidos, ítems o resúmenes; sirve de
+        # llave para las cachés de reportes
+        self.version = 0
+
+    @contextmanager
+    def _transaccion(self, datos=True):
+        """Transacción de escritura; con datos=False (registro de la sincronización) no cambia la versión."""
+        with self._lock:
+            self._con.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._con
+            except Exception:
+                self._con.execute("ROLLBACK")
+                raise
+            self._con.execute("COMMIT")
+            if datos:
+                self.version += 1
+
+    def _consultar(self, sql, parametros=()):
+        with self._lock:
+            return self._con.execute(sql, parametros).fetchall()
+
+    def leer_frame(self, sql, parametros=()):
+        """Ejecuta una consulta y retorna el resultado como DataFrame."""
+        with self._lock:
+            return pd.read_sql_query(sql, self._con, params=parametros)
+
+    def leer_por_partes(self, sql, parametros=(), tamano=5000):
+        """Itera el resultado de una consulta en DataFrames de a lo sumo `tamano` filas.
+
+        Usa una conexión de solo lectura propia, así una exportación larga no bloquea
+        las escrituras del servicio (WAL permite leer mientras se escribe).
+        """
+        con = sqlite3.connect(f"file:{self.ruta}?mode=ro", uri=True)
+        try:
+            yield from pd.read_sql_query(sql, con, params=parametros, chunksize=tamano)
+        finally:
+            con.close()
+
+    def _armar_pedidos(self, filas):
+        """Convierte filas de la tabla pedidos en diccionarios con sus productos."""
+        pedidos = [
+            {
+                "id": f["id"], "tipo": f["tipo"], "mesa": f["mesa"], "productos": [],
+                "estado": f["estado"], "hora": f["hora"], "subtotal": f["subtotal"],
+                "propina": f["propina"], "total": f["total"], "clave": f["clave"]
+            }
+            for f in filas
+        ]
+        if pedidos:
+            por_id = {p["id"]: p for p in pedidos}
+            marcas = ",".join("?" * len(por_id))
+            items = self._consultar(
+                f"SELECT * FROM items WHERE pedido_id IN ({marcas}) ORDER BY pedido_id, posicion",
+                tuple(por_id)
+            )
+            for it in items:
+                por_id[it["pedido_id"]]["productos"].append({
+                    "nombre": it["nombre"], "cantidad": it["cantidad"],
+                    "obs": it["obs"], "subtotal": it["subtotal"]
+                })
+        return pedidos
+
+    def _guardar_items(self, con, pedido):
+        con.execute("DELETE FROM items WHERE pedido_id = ?", (pedido["id"],))
+        con.executemany(
+            "INSERT INTO items (pedido_id, posicion, nombre, cantidad, obs, subtotal) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (pedido["id"], pos, it["nombre"], it["cantidad"], it["obs"], it["subtotal"])
+                for pos, it in enumerate(pedido["productos"])
+            ]
+        )
+
+    def _acumular(self, con, pedido, signo):
+        """Suma (signo=1) o resta (signo=-1) el aporte del pedido a los resúmenes diarios."""
+        dia, hora = pedido["hora"][:10], int(pedido["hora"][11:13])
+        con.execute(
+            "INSERT INTO resumen_tipo (dia, tipo, pedidos, subtotal, propina, total) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (dia, tipo) DO UPDATE SET pedidos = pedidos + excluded.pedidos, "
+            "subtotal = subtotal + excluded.subtotal, propina = propina + excluded.propina, total = total + excluded.total",
+            (dia, pedido["tipo"], signo, signo * pedido["subtotal"], signo * pedido["propina"], signo * pedido["total"])
+        )
+        con.execute(
+            "INSERT INTO resumen_hora (dia, hora, pedidos, total) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (dia, hora) DO UPDATE SET pedidos = pedidos + excluded.pedidos, total = total + excluded.total",
+            (dia, hora, signo, signo * pedido["total"])
+        )
+        con.executemany(
+            "INSERT INTO resumen_producto (dia, producto, cantidad, ventas) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (dia, producto) DO UPDATE SET cantidad = cantidad + excluded.cantidad, ventas = ventas + excluded.ventas",
+            [(dia, it["nombre"], signo * it["cantidad"], signo * it["subtotal"]) for it in pedido["productos"]]
+        )
+
+    def existe_clave(self, clave):
+        """Indica si ya se guardó un pedido con esa `clave` de formulario."""
+        return bool(self._consultar("SELECT 1 FROM pedidos WHERE clave = ? LIMIT 1", (clave,)))
+
+    def insertar_pedido(self, pedido):
+        """Guarda un pedido nuevo, le asigna su id y retorna (pedido, nuevo).
+
+        Si ya existe un pedido con la misma `clave` (el mismo formulario enviado dos
+        veces), no se guarda nada y se retorna el existente con nuevo=False.
+        """
+        with self._transaccion() as con:
+            if pedido.get("clave"):
+                existente = con.execute("SELECT * FROM pedidos WHERE clave = ?", (pedido["clave"],)).fetchall()
+                if existente:
+                    return self._armar_pedidos(existente)[0], False
+            cur = con.execute(
+                "INSERT INTO pedidos (tipo, mesa, hora, estado, subtotal, propina, total, clave) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (pedido["tipo"], pedido["mesa"], pedido["hora"], pedido["estado"],
+                 pedido["subtotal"], pedido["propina"], pedido["total"], pedido.get("clave"))
+            )
+            pedido["id"] = cur.lastrowid
+            self._guardar_items(con, pedido)
+            self._acumular(con, pedido, 1)
+            con.execute(
+                "INSERT INTO transiciones (pedido_id, estado_anterior, estado_nuevo, hora) VALUES (?, NULL, ?, ?)",
+                (pedido["id"], pedido["estado"], pedido["hora"])
+            )
+        return pedido, True
+
+    def actualizar_pedido(self, pedido):
+        """Guarda el estado, montos y productos actuales de un pedido existente."""
+        with self._transaccion() as con:
+            filas = self._armar_pedidos(con.execute("SELECT * FROM pedidos WHERE id = ?", (pedido["id"],)).fetchall())
+            anterior = filas[0] if filas else None
+            con.execute(
+                "UPDATE pedidos SET estado = ?, subtotal = ?, propina = ?, total = ? WHERE id = ?",
+                (pedido["estado"], pedido["subtotal"], pedido["propina"], pedido["total"], pedido["id"])
+            )
+            self._guardar_items(con, pedido)
+            # Ajustar los resúmenes solo si cambiaron montos o productos
+            if anterior and any(anterior[c] != pedido[c] for c in ("subtotal", "propina", "total", "productos")):
+                self._acumular(con, anterior, -1)
+                self._acumular(con, pedido, 1)
+            if anterior and anterior["estado"] != pedido["estado"]:
+                con.execute(
+                    "INSERT INTO transiciones (pedido_id, estado_anterior, estado_nuevo, hora) VALUES (?, ?, ?, ?)",
+                    (pedido["id"], anterior["estado"], pedido["estado"], datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                )
+            # Varios cambios del mismo pedido se envían a Sheets como uno solo
+            con.execute(
+                "INSERT INTO cambios_sheets (pedido_id, marca) "
+                "VALUES (?, (SELECT COALESCE(MAX(marca), 0) + 1 FROM cambios_sheets)) "
+                "ON CONFLICT (pedido_id) DO UPDATE SET marca = excluded.marca",
+                (pedido["id"],)
+            )
+
+    def rango_fechas(self):
+        """Retorna (fecha mínima, fecha máxima) de los pedidos, o None si no hay pedidos."""
+        fila = self._consultar("SELECT MIN(hora) AS minima, MAX(hora) AS maxima FROM pedidos")[0]
+        if fila["minima"] is None:
+            return None
+        return (datetime.strptime(fila["minima"], "%Y-%m-%d %H:%M:%S").date(),
+                datetime.strptime(fila["maxima"], "%Y-%m-%d %H:%M:%S").date())
+
+    def leer_resumenes(self, desde, hasta):
+        """Totales de los resúmenes diarios entre `desde` y `hasta`, como DataFrames.
+
+        Retorna un diccionario con las tablas "producto", "tipo" y "hora", con las
+        mismas columnas que `resumenes_de_frames`.
+        """
+        rango = (desde.isoformat(), hasta.isoformat())
+        return {
+            "producto": self.leer_frame(
+                "SELECT producto AS Producto, SUM(cantidad) AS Cantidad, SUM(ventas) AS Ventas "
+                "FROM resumen_producto WHERE dia BETWEEN ? AND ? GROUP BY producto", rango
+            ),
+            "tipo": self.leer_frame(
+                "SELECT tipo AS Tipo, SUM(pedidos) AS Pedidos, SUM(subtotal) AS Subtotal, "
+                "SUM(propina) AS Propina, SUM(total) AS Total "
+                "FROM resumen_tipo WHERE dia BETWEEN ? AND ? GROUP BY tipo", rango
+            ),
+            "hora": self.leer_frame(
+                "SELECT hora AS Hora, SUM(pedidos) AS Pedidos, SUM(total) AS Total "
+                "FROM resumen_hora WHERE dia BETWEEN ? AND ? GROUP BY hora", rango
+            ),
+        }
+
+    def pedidos_activos(self):
+        """Pedidos del servicio que aún no se han pagado (excluye los importados de Sheets)."""
+        marcas = ",".join("?" * len(ESTADOS_ACTIVOS))
+        return self._armar_pedidos(self._consultar(
+            f"SELECT * FROM pedidos WHERE estado IN ({marcas}) AND importado = 0 ORDER BY id", tuple(ESTADOS_ACTIVOS)
+        ))
+
+    def consultar_historial(self, limite, desplazamiento, desde=None, hasta=None, mesa=None, tipo=None, producto=None):
+        """Una página del historial (pedidos pagados o importados de Sheets), del más reciente al más antiguo.
+
+        Retorna (total de pedidos que cumplen los filtros, pedidos de la página).
+        """
+        condiciones, parametros = ["(p.estado = 'Pagado' OR p.importado = 1)"], []
+        if desde:
+            condiciones.append("p.hora >= ?")
+            parametros.append(desde.isoformat())
+        if hasta:
+            condiciones.append("p.hora < ?")
+            parametros.append((hasta + timedelta(days=1)).isoformat())
+        if mesa:
+            condiciones.append("p.mesa = ?")
+            parametros.append(mesa)
+        if tipo:
+            condiciones.append("p.tipo = ?")
+            parametros.append(tipo)
+        if producto:
+            condiciones.append("EXISTS (SELECT 1 FROM items i WHERE i.pedido_id = p.id AND i.nombre LIKE ?)")
+            parametros.append(f"%{producto}%")
+        donde = " AND ".join(condiciones)
+        total = self._consultar(f"SELECT COUNT(*) FROM pedidos p WHERE {donde}", tuple(parametros))[0][0]
+        filas = self._consultar(
+            f"SELECT p.* FROM pedidos p WHERE {donde} ORDER BY p.hora DESC, p.id DESC LIMIT ? OFFSET ?",
+            (*parametros, limite, desplazamiento)
+        )
+        return total, self._armar_pedidos(filas)
+
+    def cursor_hoja(self, hoja):
+        """Última fila de la hoja de Sheets ya leída al almacén (1 = solo encabezado)."""
+        filas = self._consultar("SELECT ultima_fila FROM cursores_hojas WHERE hoja = ?", (hoja,))
+        return filas[0]["ultima_fila"] if filas else 1
+
+    def importar_pedidos(self, pedidos, cursores):
+        """Guarda pedidos antiguos leídos de Sheets y avanza los cursores de lectura.
+
+        Se omiten los pedidos que ya son réplica de uno local (mismo id y hora). Los
+        importados reciben un id local nuevo y quedan marcados como sincronizados.
+        Retorna cuántos pedidos se importaron.
+        """
+        importados = 0
+        # Sin pedidos nuevos solo avanzan los cursores: la versión de los reportes no cambia
+        with self._transaccion(datos=False) as con:
+            for pedido in pedidos:
+                if con.execute("SELECT 1 FROM pedidos WHERE id = ? AND hora = ?", (pedido["id"], pedido["hora"])).fetchone():
+                    continue
+                cur = con.execute(
+                    "INSERT INTO pedidos (tipo, mesa, hora, estado, subtotal, propina, total, sincronizado, importado) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, 1, 1)",
+                    (pedido["tipo"], pedido["mesa"], pedido["hora"], pedido["estado"],
+                     pedido["subtotal"], pedido["propina"], pedido["total"])
+                )
+                pedido = dict(pedido, id=cur.lastrowid)
+                self._guardar_items(con, pedido)
+                self._acumular(con, pedido, 1)
+                importados += 1
+            con.executemany(
+                "INSERT INTO cursores_hojas (hoja, ultima_fila) VALUES (?, ?) "
+                "ON CONFLICT (hoja) DO UPDATE SET ultima_fila = excluded.ultima_fila",
+                list(cursores.items())
+            )
+            if importados:
+                self.version += 1
+        return importados
+
+    def pendientes_sincronizar(self):
+        """Pedidos que aún no se han replicado a Google Sheets, en orden de llegada."""
+        return self._armar_pedidos(self._consultar("SELECT * FROM pedidos WHERE sincronizado = 0 ORDER BY id"))
+
+    def marcar_sincronizados(self, ids):
+        with self._transaccion(datos=False) as con:
+            con.executemany("UPDATE pedidos SET sincronizado = 1 WHERE id = ?", [(i,) for i in ids])
+
+    def guardar_filas_sheets(self, filas):
+        """Registra la fila de Sheets de pedidos o líneas: [(pedido_id, hoja, orden, fila), ...]."""
+        with self._transaccion(datos=False) as con:
+            con.executemany(
+                "INSERT INTO filas_sheets (pedido_id, hoja, orden, fila) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (pedido_id, hoja, orden) DO UPDATE SET fila = excluded.fila",
+                filas
+            )
+
+    def filas_sheets(self, ids):
+        """Filas conocidas de cada pedido: {id: {"Pedidos": fila o None, "Items": [filas en orden]}}."""
+        ubicaciones = {i: {"Pedidos": None, "Items": []} for i in ids}
+        if ids:
+            marcas = ",".join("?" * len(ids))
+            for f in self._consultar(
+                f"SELECT * FROM filas_sheets WHERE pedido_id IN ({marcas}) ORDER BY pedido_id, hoja, orden", tuple(ids)
+            ):
+                if f["hoja"] == "Pedidos":
+                    ubicaciones[f["pedido_id"]]["Pedidos"] = f["fila"]
+                else:
+                    ubicaciones[f["pedido_id"]]["Items"].append(f["fila"])
+        return ubicaciones
+
+    def pedidos_en_filas(self, hoja, desde, hasta):
+        """Pedido al que pertenece cada fila de la hoja entre `desde` y `hasta` según el índice: {fila: pedido_id}."""
+        return {
+            f["fila"]: f["pedido_id"]
+            for f in self._consultar(
+                "SELECT pedido_id, fila FROM filas_sheets WHERE hoja = ? AND fila BETWEEN ? AND ?", (hoja, desde, hasta)
+            )
+        }
+
+    def ultima_fila_sheets(self, hoja):
+        """Fila más baja de la hoja de Sheets registrada en el índice, o 1 si no hay ninguna."""
+        filas = self._consultar("SELECT MAX(fila) AS fila FROM filas_sheets WHERE hoja = ?", (hoja,))
+        return filas[0]["fila"] or 1
+
+    def cambios_pendientes(self, limite=200):
+        """Pedidos ya replicados en Sheets con cambios sin enviar.
+
+        Retorna (pedidos, marcas); las marcas se devuelven a `confirmar_cambios`.
+        """
+        # CROSS JOIN fija el orden: se recorren solo los cambios y cada pedido se busca por id
+        filas = self._consultar(
+            "SELECT p.*, c.marca FROM cambios_sheets c CROSS JOIN pedidos p ON p.id = c.pedido_id "
+            "WHERE p.sincronizado = 1 ORDER BY c.marca LIMIT ?", (limite,)
+        )
+        return self._armar_pedidos(filas), {f["id"]: f["marca"] for f in filas}
+
+    def confirmar_cambios(self, marcas):
+        """Da por enviados los cambios; uno más reciente que su marca queda pendiente."""
+        with self._transaccion(datos=False) as con:
+            con.executemany(
+                "DELETE FROM cambios_sheets WHERE pedido_id = ? AND marca = ?", list(marcas.items())
+            )
+
+@st.cache_resource
+def obtener_almacen():
+    """Almacén local compartido por todas las sesiones del proceso."""
+    return AlmacenPedidos()
+
+# --- Registro compartido de pedidos ---
+class RegistroPedidos:
+    """Registro de pedidos compartido por todas las sesiones del proceso.
+
+    Meseros y cocina ven los mismos pedidos: los activos se mantienen en memoria y
+    toda modificación pasa por este registro bajo un lock, se escribe primero en el
+    almacén local y solo entonces queda visible. Las lecturas retornan copias, así
+    una sesión nunca modifica ni sobrescribe el pedido de otra con datos viejos.
+    Los activos se indexan por estado y por mesa, y los índices se actualizan en
+    cada cambio, así las consultas por estado o mesa no recorren todos los pedidos.
+    """
+
+    def __init__(self, almacen):
+        self._almacen = almacen
+        self._lock = threading.RLock()
+        self._activos = {}
+        self._por_estado = {estado: {} for estado in ESTADOS_ACTIVOS}
+        self._por_mesa = {}
+        for pedido in almacen.pedidos_activos():
+            self._indexar(pedido)
+        # Aumenta con cada cambio; permite a las vistas saber si algo cambió
+        self.version = 0
+        # Últimos eventos publicados: (version, tipo, id del pedido)
+        self._eventos = deque(maxlen=500)
+
+    def _indexar(self, pedido):
+        self._activos[pedido["id"]] = pedido
+        self._por_estado[pedido["estado"]][pedido["id"]] = pedido
+        if pedido["mesa"]:
+            self._por_mesa.setdefault(pedido["mesa"], {})[pedido["id"]] = pedido
+
+    def _desindexar(self, pedido_id):
+        pedido = self._activos.pop(pedido_id, None)
+        if pedido is None:
+            return
+        self._por_estado[pedido["estado"]].pop(pedido_id, None)
+        en_mesa = self._por_mesa.get(pedido["mesa"])
+        if en_mesa is not None:
+            en_mesa.pop(pedido_id, None)
+            if not en_mesa:
+                del self._por_mesa[pedido["mesa"]]
+
+    def _publicar(self, tipo, pedido):
+        self.version += 1
+        self._eventos.append((self.version, tipo, pedido["id"]))
+
+    def _confirmar(self, pedido, tipo):
+        """Persiste el pedido modificado y lo publica para las demás sesiones."""
+        self._almacen.actualizar_pedido(pedido)
+        self._desindexar(pedido["id"])
+        if pedido["estado"] in ESTADOS_ACTIVOS:
+            self._indexar(pedido)
+        self._publicar(tipo, pedido)
+        return copy.deepcopy(pedido)
+
+    def _copia_activo(self, pedido_id):
+        """Copia de trabajo del pedido activo, o None si ya no está activo."""
+        pedido = self._activos.get(pedido_id)
+        return copy.deepcopy(pedido) if pedido else None
+
+    def obtener(self, pedido_id):
+        """Copia del pedido activo, o None si ya no está activo."""
+        with self._lock:
+            return self._copia_activo(pedido_id)
+
+    def cambios_desde(self, version):
+        """Ids de los pedidos que cambiaron después de `version`.
+
+        Retorna (versión actual, ids). `ids` es None si los eventos de esa versión
+        ya se descartaron, o si `version` es de un registro anterior (la caché se
+        limpió y el contador volvió a empezar), y la vista debe recargar todo.
+        """
+        with self._lock:
+            if version == self.version:
+                return self.version, set()
+            if version < 0 or version > self.version or not self._eventos or self._eventos[0][0] > version + 1:
+                return self.version, None
+            return self.version, {pedido_id for v, _, pedido_id in self._eventos if v > version}
+
+    def crear_pedido(self, pedido):
+        """Registra un pedido nuevo y retorna (pedido, nuevo); el id se asigna de forma atómica en el almacén.
+
+        Un reenvío con la misma clave retorna el pedido ya registrado con nuevo=False.
+        """
+        with self._lock:
+            pedido, nuevo = self._almacen.insertar_pedido(copy.deepcopy(pedido))
+            if nuevo:
+                self._indexar(pedido)
+                self._publicar("creado", pedido)
+            return copy.deepcopy(pedido), nuevo
+
+    def pedidos_por_estado(self, estado):
+        with self._lock:
+            en_estado = self._por_estado.get(estado, {})
+            return [copy.deepcopy(en_estado[i]) for i in sorted(en_estado)]
+
+    def mesa_ocupada(self, mesa):
+        with self._lock:
+            return bool(self._por_mesa.get(mesa))
+
+    def estado_mesas(self, mesas=MESAS):
+        """Resumen por mesa para el mapa: pedidos abiertos, total acumulado, hora del primero y su estado."""
+        with self._lock:
+            resumen = []
+            for mesa in mesas:
+                pedidos = sorted(self._por_mesa.get(mesa, {}).values(), key=lambda p: p["hora"])
+                resumen.append({
+                    "mesa": mesa, "pedidos": len(pedidos), "total": sum(p["total"] for p in pedidos),
+                    "desde": pedidos[0]["hora"] if pedidos else None,
+                    "estado": pedidos[0]["estado"] if pedidos else None
+                })
+            return resumen
+
+    def avanzar_estado(self, pedido_id):
+        with self._lock:
+            pedido = self._copia_activo(pedido_id)
+            if pedido is None:
+                return None
+            idx = ESTADOS.index(pedido["estado"])
+            if idx < len(ESTADOS) - 1:
+                pedido["estado"] = ESTADOS[idx + 1]
+            return self._confirmar(pedido, "estado")
+
+    def aplicar_propina(self, pedido_id, propina):
+        with self._lock:
+            pedido = self._copia_activo(pedido_id)
+            if pedido is None:
+                return None
+            pedido["propina"] = round(propina, 2)
+            pedido["total"] = round(pedido["subtotal"] + pedido["propina"], 2)
+            return self._confirmar(pedido, "propina")
+
+    def agregar_producto(self, pedido_id, item):
+        with self._lock:
+            pedido = self._copia_activo(pedido_id)
+            if pedido is None:
+                return None
+            pedido["productos"].append(dict(item))
+            pedido["subtotal"] = sum(x["subtotal"] for x in pedido["productos"])
+            pedido["total"] = pedido["subtotal"] + pedido["propina"]
+            return self._confirmar(pedido, "productos")
+
+    def eliminar_cantidad(self, pedido_id, posicion, nombre, cantidad, precio):
+        """Quita `cantidad` unidades del producto en `posicion`.
+
+        Retorna None si el pedido ya no está activo o si otra sesión cambió sus
+        productos (el producto en esa posición ya no es `nombre`).
+        """
+        with self._lock:
+            pedido = self._copia_activo(pedido_id)
+            if pedido is None or posicion >= len(pedido["productos"]) or pedido["productos"][posicion]["nombre"] != nombre:
+                return None
+            item = pedido["productos"][posicion]
+            item["cantidad"] -= cantidad
+            if item["cantidad"] <= 0:
+                pedido["productos"].pop(posicion)
+            else:
+                item["subtotal"] = item["cantidad"] * precio
+            pedido["subtotal"] = sum(x["subtotal"] for x in pedido["productos"])
+            pedido["total"] = pedido["subtotal"] + pedido["propina"]
+            return self._confirmar(pedido, "productos")
+
+@st.cache_resource
+def obtener_registro():
+    """Registro de pedidos compartido por todas las sesiones del proceso."""
+    return RegistroPedidos(obtener_almacen())
+
+# --- Motor de reportes ---
+def tipar_frames(df_pedidos, df_items):
+    """Convierte la hora a datetime y las columnas repetitivas a categóricas."""
+    df_pedidos["Fecha_Venta"] = pd.to_datetime(df_pedidos["Fecha_Venta"], format="%Y-%m-%d %H:%M:%S")
+    df_pedidos = df_pedidos.astype({"Tipo": "category", "Mesa": "category", "Estado": "category"})
+    df_items = df_items.astype({"Producto": "category"})
+    return df_pedidos, df_items
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def cargar_frames_ventas(desde, hasta, version):
+    """Pedidos e ítems entre las fechas `desde` y `hasta` como DataFrames tipados.
+
+    `version` es la versión de datos del almacén: el resultado se reutiliza hasta
+    que se confirme una nueva escritura.
+    """
+    almacen = obtener_almacen()
+    rango = (desde.isoformat(), (hasta + timedelta(days=1)).isoformat())
+    df_pedidos = almacen.leer_frame(
+        "SELECT id AS Id_pedido, tipo AS Tipo, mesa AS Mesa, hora AS Fecha_Venta, estado AS Estado, "
+        "subtotal AS Subtotal, propina AS Propina, total AS Total "
+        "FROM pedidos WHERE hora >= ? AND hora < ? ORDER BY id", rango
+    )
+    df_items = almacen.leer_frame(
+        "SELECT i.pedido_id AS Id_pedido, i.nombre AS Producto, i.cantidad AS Cantidad, i.obs AS Obs, i.subtotal AS Valor "
+        "FROM items i JOIN pedidos p ON p.id = i.pedido_id "
+        "WHERE p.hora >= ? AND p.hora < ? ORDER BY i.pedido_id, i.posicion", rango
+    )
+    return tipar_frames(df_pedidos, df_items)
+
+def detalle_ventas(df_pedidos, df_items, categorias):
+    """Una fila por producto vendido, con los datos de su pedido y la categoría del producto.
+
+    `categorias` es un diccionario nombre de producto → categoría.
+    """
+    detalle = df_items.merge(df_pedidos[["Id_pedido", "Fecha_Venta", "Tipo", "Estado"]], on="Id_pedido")
+    detalle["Categoría"] = (
+        detalle["Producto"].astype(str).map(categorias).fillna("Sin categoría").astype("category")
+    )
+    return detalle[["Fecha_Venta", "Tipo", "Estado", "Id_pedido", "Producto", "Categoría", "Cantidad", "Valor"]]
+
+def resumenes_de_frames(df_pedidos, df_items):
+    """Calcula sobre pedidos crudos las mismas tablas que `AlmacenPedidos.leer_resumenes`."""
+    return {
+        "producto": df_items.groupby("Producto", observed=True)
+            .agg(Cantidad=("Cantidad", "sum"), Ventas=("Valor", "sum")).reset_index(),
+        "tipo": df_pedidos.groupby("Tipo", observed=True)
+            .agg(Pedidos=("Id_pedido", "count"), Subtotal=("Subtotal", "sum"), Propina=("Propina", "sum"), Total=("Total", "sum"))
+            .reset_index(),
+        "hora": df_pedidos.groupby(df_pedidos["Fecha_Venta"].dt.hour.rename("Hora"))
+            .agg(Pedidos=("Id_pedido", "count"), Total=("Total", "sum")).reset_index(),
+    }
+
+def agregados_ventas(partes, categorias):
+    """Une resúmenes parciales en los totales por producto, categoría, hora del día y tipo.
+
+    `partes` son diccionarios como los de `leer_resumenes` / `resumenes_de_frames`
+    (p. ej. días cerrados + día en curso). `categorias` es nombre de producto → categoría.
+    """
+    def unir(tabla, llave, tipo=str):
+        df = pd.concat([parte[tabla].astype({llave: tipo}) for parte in partes]).groupby(llave).sum()
+        return df[(df != 0).any(axis=1)]
+    por_producto = unir("producto", "Producto").sort_values("Ventas", ascending=False)
+    por_categoria = por_producto.groupby(
+        por_producto.index.map(categorias).fillna("Sin categoría").rename("Categoría")
+    ).sum().sort_values("Ventas", ascending=False)
+    return {
+        "Por producto": por_producto,
+        "Por categoría": por_categoria,
+        "Por hora": unir("hora", "Hora", int).sort_index(),
+        "Por tipo": unir("tipo", "Tipo"),
+    }
+
+# --- Exportación de reportes ---
+FORMATOS_EXPORTACION = {
+    "Excel": ("reportes_pedidos.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV": ("reportes_pedidos_csv.zip", "application/zip"),
+}
+if pq is not None:
+    FORMATOS_EXPORTACION["Parquet"] = ("reportes_pedidos_parquet.zip", "application/zip")
+
+# Hojas del archivo exportado: (nombre, consulta, columnas con su tipo para Parquet)
+TABLAS_EXPORTACION = [
+    ("Detalle",
+     "SELECT p.hora AS Fecha_Venta, p.tipo AS Tipo, p.estado AS Estado, p.id AS Id_pedido, "
+     "i.nombre AS Producto, '' AS Categoría, i.cantidad AS Cantidad, i.subtotal AS Valor "
+     "FROM items i JOIN pedidos p ON p.id = i.pedido_id "
+     "WHERE p.hora >= ? AND p.hora < ? ORDER BY p.id, i.posicion",
+     {"Fecha_Venta": "timestamp", "Tipo": "string", "Estado": "string", "Id_pedido": "int64",
+      "Producto": "string", "Categoría": "string", "Cantidad": "int64", "Valor": "float64"}),
+    ("Resumen",
+     "SELECT hora AS Fecha_Venta, tipo AS Tipo, mesa AS Mesa, estado AS Estado, id AS Id_pedido, "
+     "subtotal AS Subtotal, propina AS Propina, total AS Total "
+     "FROM pedidos WHERE hora >= ? AND hora < ? ORDER BY id",
+     {"Fecha_Venta": "timestamp", "Tipo": "string", "Mesa": "string", "Estado": "string", "Id_pedido": "int64",
+      "Subtotal": "float64", "Propina": "float64", "Total": "float64"}),
+]
+
+def partes_exportacion(almacen, consulta, desde, hasta, categorias):
+    """Filas de una hoja de la exportación, en bloques, con la categoría de cada producto."""
+    rango = (desde.isoformat(), (hasta + timedelta(days=1)).isoformat())
+    for parte in almacen.leer_por_partes(consulta, rango):
+        if "Categoría" in parte:
+            parte["Categoría"] = parte["Producto"].map(categorias).fillna("Sin categoría")
+        yield parte
+
+def escribir_excel(salida, almacen, desde, hasta, categorias):
+    # constant_memory: cada fila se vuelca a disco apenas se escribe
+    libro = xlsxwriter.Workbook(salida, {"constant_memory": True, "tmpdir": tempfile.gettempdir()})
+    for nombre, consulta, columnas in TABLAS_EXPORTACION:
+        hoja = libro.add_worksheet(nombre)
+        hoja.write_row(0, 0, list(columnas))
+        fila = 1
+        for parte in partes_exportacion(almacen, consulta, desde, hasta, categorias):
+            # Celdas vacías (p. ej. la mesa de un pedido para llevar): xlsxwriter no acepta NaN
+            parte = parte.astype(object).where(parte.notna(), None)
+            for valores in parte.itertuples(index=False, name=None):
+                hoja.write_row(fila, 0, valores)
+                fila += 1
+    libro.close()
+
+def escribir_csv(salida, almacen, desde, hasta, categorias):
+    with zipfile.ZipFile(salida, "w", zipfile.ZIP_DEFLATED) as zf:
+        for nombre, consulta, _ in TABLAS_EXPORTACION:
+            with zf.open(f"{nombre.lower()}.csv", "w") as crudo, io.TextIOWrapper(crudo, encoding="utf-8-sig", newline="") as archivo:
+                encabezado = True
+                for parte in partes_exportacion(almacen, consulta, desde, hasta, categorias):
+                    parte.to_csv(archivo, header=encabezado, index=False)
+                    encabezado = False
+
+def escribir_parquet(salida, almacen, desde, hasta, categorias):
+    tipos = {"timestamp": pa.timestamp("s"), "string": pa.string(), "int64": pa.int64(), "float64": pa.float64()}
+    with zipfile.ZipFile(salida, "w", zipfile.ZIP_STORED) as zf:
+        for nombre, consulta, columnas in TABLAS_EXPORTACION:
+            esquema = pa.schema([(col, tipos[tipo]) for col, tipo in columnas.items()])
+            with zf.open(f"{nombre.lower()}.parquet", "w") as archivo, pq.ParquetWriter(archivo, esquema) as escritor:
+                for parte in partes_exportacion(almacen, consulta, desde, hasta, categorias):
+                    parte["Fecha_Venta"] = pd.to_datetime(parte["Fecha_Venta"], format="%Y-%m-%d %H:%M:%S")
+                    escritor.write_table(pa.Table.from_pandas(parte, schema=esquema, preserve_index=False))
+
+@st.cache_data(max_entries=4, show_spinner="Generando archivo...")
+def exportar_reporte(desde, hasta, formato, version, categorias):
+    """Genera el archivo de exportación y retorna sus bytes.
+
+    Los datos se leen y escriben por bloques hacia un archivo temporal, sin armar
+    todo el reporte en memoria. El resultado queda en caché por rango de fechas,
+    formato y versión de datos del almacén.
+    """
+    escribir = {"Excel": escribir_excel, "CSV": escribir_csv, "Parquet": escribir_parquet}[formato]
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as salida:
+        escribir(salida, obtener_almacen(), desde, hasta, categorias)
+        salida.seek(0)
+        return salida.read()
+
+# --- Conexión a Google Sheets ---
+CUOTA_SHEETS_POR_MINUTO = 60  # Cuota de la API de Sheets por usuario y por minuto
+
+def autorizar_hoja():
+    """Autoriza la cuenta de servicio y abre la hoja de cálculo CampiAsadosDB."""
+    scope = [
+        "https://www.googleapis.com/auth/spreadsheets",
+        "https://www.googleapis.com/auth/drive"
+    ]
+    creds_dict = json.loads(st.secrets["GOOGLE_SHEETS_CREDENTIALS"])
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+    cliente = gspread.authorize(creds)
+    hoja = cliente.open("CampiAsadosDB")
+    return hoja
+
+def estado_http(error):
+    """Código HTTP de un error de gspread, o None si no vino de la API."""
+    respuesta = getattr(error, "response", None)
+    return getattr(respuesta, "status_code", None) if isinstance(error, gspread.exceptions.APIError) else None
+
+def es_limite_cuota(error):
+    """Indica si el error de gspread corresponde a un límite de cuota (HTTP 429)."""
+    return estado_http(error) == 429
+
+def es_falla_transitoria(error):
+    """Indica si el error sugiere que Sheets no está disponible (y no un error de uso, como una hoja inexistente)."""
+    estado = estado_http(error)
+    if estado is not None:
+        return estado in (401, 429) or estado >= 500
+    return not isinstance(error, gspread.exceptions.GSpreadException)
+
+class LimitadorCuota:
+    """Cubeta de fichas: admite ráfagas de `capacidad` llamadas y en promedio `por_minuto` llamadas por minuto."""
+
+    def __init__(self, por_minuto=CUOTA_SHEETS_POR_MINUTO, capacidad=10):
+        self.tasa = por_minuto / 60.0
+        self.capacidad = capacidad
+        self._fichas = float(capacidad)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def tomar(self):
+        """Espera hasta que haya una ficha y la consume; retorna los segundos esperados."""
+        esperado = 0.0
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._fichas = min(self.capacidad, self._fichas + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return esperado
+                falta = (1 - self._fichas) / self.tasa
+            time.sleep(falta)
+            esperado += falta
+
+    def vaciar(self):
+        """Descarta las fichas acumuladas, p. ej. tras recibir un 429."""
+        with self._lock:
+            self._fichas = 0.0
+            self._ultimo = time.monotonic()
+
+class CircuitoAbierto(Exception):
+    """Sheets está marcado como no disponible; la llamada no se intentó."""
+
+    def __init__(self, restante):
+        super().__init__(f"Sheets no disponible, se reintentará en {restante:.0f} s")
+        self.restante = restante
+
+class ClienteSheets:
+    """Cliente de Sheets compartido: limita el ritmo de llamadas, renueva la sesión y corta ante caídas.
+
+    Todas las llamadas a la API pasan por `llamar`, que toma una ficha del
+    limitador, reintenta brevemente los 429 y vuelve a autorizar si la sesión
+    venció. Tras `umbral_fallos` fallas seguidas el circuito se abre: durante
+    `pausa` segundos las llamadas fallan de inmediato con CircuitoAbierto (los
+    pedidos siguen guardándose en el almacén local y la cola los envía al
+    volver), y luego se deja pasar una llamada de prueba.
+    """
+
+    def __init__(self, autorizar, limitador=None, umbral_fallos=3, pausa=30.0,
+                 vida_sesion=45 * 60, reintentos_cuota=2):
+        self._autorizar = autorizar
+        self.limitador = limitador or LimitadorCuota()
+        self.umbral_fallos = umbral_fallos
+        self.pausa = pausa
+        self.vida_sesion = vida_sesion
+        self.reintentos_cuota = reintentos_cuota
+        self._lock = threading.RLock()
+        self._libro = None
+        self._hojas = {}
+        self._autorizado_en = 0.0
+        self.fallos_seguidos = 0
+        self.abierto_hasta = 0.0
+        self.llamadas = 0
+        self.limites_cuota = 0
+        self.errores = 0
+        self.rechazadas = 0
+        self.reautorizaciones = 0
+        self.latencias = deque(maxlen=500)
+
+    def _objetivo(self, nombre):
+        """Retorna el libro (nombre None) o la hoja indicada, autorizando de nuevo si la sesión venció."""
+        with self._lock:
+            if self._libro is None or time.monotonic() - self._autorizado_en > self.vida_sesion:
+                if self._autorizado_en:
+                    self.reautorizaciones += 1
+                self._libro = self._autorizar()
+                self._hojas = {}
+                self._autorizado_en = time.monotonic()
+            if nombre is None:
+                return self._libro
+            if nombre not in self._hojas:
+                self._hojas[nombre] = self._libro.worksheet(nombre)
+            return self._hojas[nombre]
+
+    def _revisar_circuito(self):
+        with self._lock:
+            if self.fallos_seguidos < self.umbral_fallos:
+                return
+            restante = self.abierto_hasta - time.monotonic()
+            if restante > 0:
+                self.rechazadas += 1
+                raise CircuitoAbierto(restante)
+            # Semiabierto: esta llamada es la prueba; las demás siguen rechazadas mientras tanto
+            self.abierto_hasta = time.monotonic() + self.pausa
+
+    def _registrar(self, inicio, error=None, final=True):
+        """Anota la llamada; solo el resultado final de `llamar` cuenta para el circuito."""
+        with self._lock:
+            self.llamadas += 1
+            self.latencias.append(time.perf_counter() - inicio)
+            if not final:
+                return
+            if error is None or not es_falla_transitoria(error):
+                # Sheets respondió (aunque sea con un error de uso): el servicio está disponible
+                self.fallos_seguidos = 0
+            else:
+                self.errores += 1
+                self.fallos_seguidos += 1
+                if self.fallos_seguidos >= self.umbral_fallos:
+                    self.abierto_hasta = time.monotonic() + self.pausa
+
+    def llamar(self, nombre, metodo, *args, **kwargs):
+        """Ejecuta `metodo` sobre el libro (nombre None) o sobre la hoja `nombre`."""
+        with obtener_perfilador().tramo(f"Sheets {nombre or 'libro'}.{metodo}"):
+            return self._llamar(nombre, metodo, *args, **kwargs)
+
+    def _llamar(self, nombre, metodo, *args, **kwargs):
+        self._revisar_circuito()
+        reintentos, reautorizado = 0, False
+        while True:
+            self.limitador.tomar()
+            inicio = time.perf_counter()
+            try:
+                resultado = getattr(self._objetivo(nombre), metodo)(*args, **kwargs)
+            except Exception as e:
+                if es_limite_cuota(e):
+                    with self._lock:
+                        self.limites_cuota += 1
+                    self.limitador.vaciar()
+                    if reintentos < self.reintentos_cuota:
+                        self._registrar(inicio, final=False)
+                        reintentos += 1
+                        time.sleep(2 ** reintentos)
+                        continue
+                elif estado_http(e) == 401 and not reautorizado:
+                    # Sesión vencida: autorizar de nuevo y repetir una vez
+                    with self._lock:
+                        self._libro = None
+                    self._registrar(inicio, final=False)
+                    reautorizado = True
+                    continue
+                self._registrar(inicio, e)
+                raise
+            self._registrar(inicio)
+            return resultado
+
+    def estado(self):
+        """'normal', 'modo local' (circuito abierto) o 'prueba' (se permitirá un intento)."""
+        with self._lock:
+            if self.fallos_seguidos < self.umbral_fallos:
+                return "normal"
+            return "modo local" if self.abierto_hasta > time.monotonic() else "prueba"
+
+    def metricas(self):
+        """Contadores y percentiles de latencia (ms) de las últimas llamadas."""
+        with self._lock:
+            orden = sorted(self.latencias)
+            percentil = lambda p: orden[min(len(orden) - 1, int(p / 100 * len(orden)))] * 1000 if orden else None
+            return {
+                "estado": self.estado(), "llamadas": self.llamadas, "limites_cuota": self.limites_cuota,
+                "errores": self.errores, "rechazadas": self.rechazadas, "reautorizaciones": self.reautorizaciones,
+                "p50": percentil(50), "p95": percentil(95), "p99": percentil(99),
+            }
+
+class HojaGestionada:
+    """Representa el libro (nombre None) o una hoja; cada método se ejecuta a través del ClienteSheets."""
+
+    def __init__(self, cliente, nombre=None):
+        self._cliente = cliente
+        self._nombre = nombre
+
+    def __getattr__(self, metodo):
+        return lambda *args, **kwargs: self._cliente.llamar(self._nombre, metodo, *args, **kwargs)
+
+# --- Hoja de cálculo en memoria (mediciones sin Google) ---
+class RespuestaSimulada:
+    """Respuesta HTTP mínima para construir errores de gspread simulados."""
+
+    def __init__(self, status_code, mensaje):
+        self.status_code = status_code
+        self.text = mensaje
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": self.text, "status": "RESOURCE_EXHAUSTED"}}
+
+class HojaEnMemoria:
+    """Hoja de trabajo simulada con los métodos de gspread que usa la app."""
+
+    def __init__(self, libro, titulo, filas):
+        self.libro = libro
+        self.title = titulo
+        self.filas = [list(fila) for fila in filas]
+
+    def _indices(self, rango):
+        """Convierte un rango A1 en (fila_inicio, fila_fin, col_inicio, col_fin), base 0 y fin exclusivo."""
+        grilla = gspread.utils.a1_range_to_grid_range(rango.split("!")[-1])
+        return (grilla.get("startRowIndex", 0), grilla.get("endRowIndex", len(self.filas)),
+                grilla.get("startColumnIndex", 0), grilla.get("endColumnIndex"))
+
+    def _leer(self, rango):
+        fila_ini, fila_fin, col_ini, col_fin = self._indices(rango)
+        return [fila[col_ini:col_fin] for fila in self.filas[fila_ini:fila_fin]]
+
+    def _escribir(self, rango, valores):
+        fila_ini, _, col_ini, _ = self._indices(rango)
+        for desplazamiento, valores_fila in enumerate(valores):
+            while len(self.filas) <= fila_ini + desplazamiento:
+                self.filas.append([])
+            fila = self.filas[fila_ini + desplazamiento]
+            fila.extend([""] * (col_ini + len(valores_fila) - len(fila)))
+            fila[col_ini:col_ini + len(valores_fila)] = valores_fila
+
+    def get(self, rango, value_render_option=None):
+        self.libro.simular()
+        return self._leer(rango)
+
+    def batch_get(self, rangos, value_render_option=None):
+        self.libro.simular()
+        return [self._leer(rango) for rango in rangos]
+
+    def row_values(self, fila):
+        self.libro.simular()
+        return list(self.filas[fila - 1]) if fila <= len(self.filas) else []
+
+    def col_values(self, columna):
+        self.libro.simular()
+        return [fila[columna - 1] if len(fila) >= columna else "" for fila in self.filas]
+
+    def get_all_records(self):
+        self.libro.simular()
+        encabezados = self.filas[0] if self.filas else []
+        return [dict(zip(encabezados, fila + [""] * (len(encabezados) - len(fila)))) for fila in self.filas[1:]]
+
+    def find(self, valor, in_column=None):
+        self.libro.simular()
+        for num_fila, fila in enumerate(self.filas, start=1):
+            for num_col, celda in enumerate(fila, start=1):
+                if (in_column is None or num_col == in_column) and str(celda) == str(valor):
+                    return gspread.cell.Cell(num_fila, num_col, celda)
+        return None
+
+    def append_rows(self, valores, include_values_in_response=False, **kwargs):
+        self.libro.simular()
+        inicio = len(self.filas) + 1
+        self.filas.extend(list(fila) for fila in valores)
+        ancho = max((len(fila) for fila in valores), default=1)
+        actualizacion = {
+            "updatedRange": f"{self.title}!A{inicio}:{gspread.utils.rowcol_to_a1(len(self.filas), ancho)}",
+            "updatedRows": len(valores)
+        }
+        if include_values_in_response:
+            actualizacion["updatedData"] = {"values": [list(fila) for fila in valores]}
+        return {"updates": actualizacion}
+
+    def append_row(self, fila, **kwargs):
+        return self.append_rows([fila], **kwargs)
+
+    def update(self, valores, range_name="A1", **kwargs):
+        self.libro.simular()
+        self._escribir(range_name, valores)
+
+    def batch_update(self, datos, **kwargs):
+        self.libro.simular()
+        for dato in datos:
+            self._escribir(dato["range"], dato["values"])
+
+    def delete_rows(self, inicio, fin=None):
+        self.libro.simular()
+        del self.filas[inicio - 1:fin or inicio]
+
+class LibroEnMemoria:
+    """Hoja de cálculo simulada que reemplaza a CampiAsadosDB en mediciones y pruebas.
+
+    Cada llamada tarda `latencia` segundos (±50 %) y, si se indica
+    `cuota_por_minuto`, responde 429 al superarla, igual que la API de Sheets.
+    """
+
+    def __init__(self, hojas, latencia=0.0, cuota_por_minuto=None, semilla=None):
+        self.hojas = {titulo: HojaEnMemoria(self, titulo, filas) for titulo, filas in hojas.items()}
+        self.latencia = latencia
+        self.cuota_por_minuto = cuota_por_minuto
+        self._azar = random.Random(semilla)
+        self._recientes = deque()
+        self._lock = threading.Lock()
+
+    def simular(self):
+        """Aplica la latencia y el límite de cuota simulados a una llamada."""
+        with self._lock:
+            ahora = time.monotonic()
+            if self.cuota_por_minuto:
+                while self._recientes and ahora - self._recientes[0] > 60:
+                    self._recientes.popleft()
+                if len(self._recientes) >= self.cuota_por_minuto:
+                    raise gspread.exceptions.APIError(RespuestaSimulada(429, "Quota exceeded (simulado)"))
+                self._recientes.append(ahora)
+            espera = self.latencia * self._azar.uniform(0.5, 1.5)
+        if espera:
+            time.sleep(espera)
+
+    def worksheet(self, titulo):
+        self.simular()
+        if titulo not in self.hojas:
+            raise gspread.exceptions.WorksheetNotFound(titulo)
+        return self.hojas[titulo]
+
+    def values_batch_update(self, cuerpo):
+        self.simular()
+        for dato in cuerpo["data"]:
+            titulo, rango = dato["range"].split("!")
+            self.hojas[titulo]._escribir(rango, dato["values"])
+        return {"totalUpdatedRows": len(cuerpo["data"])}
+
+def crear_libro_en_memoria(latencia=0.0, cuota_por_minuto=None):
+    """Libro simulado con los encabezados de Pedidos e Items y el catálogo por defecto."""
+    return LibroEnMemoria({
+        "Pedidos": [["ID", "Tipo", "Mesa", "Hora", "Estado", "Subtotal", "Propina", "Total"]],
+        "Items": [["ID", "Nombre", "Cantidad", "Obs", "Subtotal"]],
+        "Productos": [["Nombre", "Precio", "Descripción", "Categoría"]] + [
+            [nombre, info["precio"], info["descripcion"], info["categoria"]]
+            for nombre, info in PRODUCTOS_POR_DEFECTO.items()
+        ],
+    }, latencia, cuota_por_minuto)
+
+@st.cache_resource
+def obtener_cliente_sheets():
+    """Cliente de Sheets único compartido por todas las sesiones.
+
+    Con CAMPI_SHEETS=memoria se usa un libro simulado en lugar de Google;
+    CAMPI_SHEETS_LATENCIA (segundos por llamada) y CAMPI_SHEETS_CUOTA (llamadas
+    por minuto) ajustan la simulación.
+    """
+    if os.environ.get("CAMPI_SHEETS") == "memoria":
+        libro = crear_libro_en_memoria(
+            float(os.environ.get("CAMPI_SHEETS_LATENCIA", 0)), int(os.environ.get("CAMPI_SHEETS_CUOTA", 0)) or None
+        )
+        return ClienteSheets(lambda: libro)
+    return ClienteSheets(autorizar_hoja)
+
+def conectar_hoja():
+    """Retorna la hoja de cálculo CampiAsadosDB a través del cliente compartido."""
+    return HojaGestionada(obtener_cliente_sheets())
+
+def obtener_hoja_trabajo(nombre):
+    """Retorna la hoja de trabajo (worksheet) indicada; su metadata se reutiliza dentro del cliente."""
+    return HojaGestionada(obtener_cliente_sheets(), nombre)
+
+def fila_pedido(pedido):
+    """Convierte un pedido en su fila para la hoja Pedidos."""
+    return [
+        pedido["id"],
+        pedido["tipo"],
+        pedido["mesa"] or "",
+        pedido["hora"],
+        pedido["estado"],
+        pedido["subtotal"],
+        pedido["propina"],
+        pedido["total"]
+    ]
+
+def filas_items(pedido):
+    """Convierte los productos de un pedido en filas para la hoja Items."""
+    return [
+        [pedido["id"], item["nombre"], item["cantidad"], item["obs"], item["subtotal"]]
+        for item in pedido["productos"]
+    ]
+
+def primera_fila(respuesta):
+    """Número de la primera fila escrita según la respuesta de un append de Sheets."""
+    rango = respuesta.get("updates", {}).get("updatedRange", "")
+    return gspread.utils.a1_range_to_grid_range(rango.split("!")[-1]).get("startRowIndex", 0) + 1
+
+def fila_en_hoja(pedido):
+    """Fila de la hoja Pedidos con el id y la hora del pedido según la copia local, o None."""
+    df_hoja = obtener_sincronizador().sincronizar("Pedidos")
+    if len(df_hoja.columns) <= 3:
+        return None
+    # Mismo criterio que la importación: id y hora identifican al pedido en la hoja
+    coincide = (df_hoja.iloc[:, 0].astype(str) == str(pedido["id"])) & (df_hoja.iloc[:, 3].astype(str) == str(pedido["hora"]))
+    posiciones = coincide.to_numpy().nonzero()[0]
+    return int(posiciones[-1]) + 2 if len(posiciones) else None
+
+def filas_items_en_hoja(pedido, despues_de):
+    """Filas de la hoja Items con el id del pedido posteriores a `despues_de`, según la copia local."""
+    df_hoja = obtener_sincronizador().sincronizar("Items")
+    if df_hoja.empty:
+        return []
+    posiciones = (df_hoja.iloc[:, 0].astype(str) == str(pedido["id"])).to_numpy().nonzero()[0] + 2
+    return [int(fila) for fila in posiciones if fila > despues_de]
+
+def escribir_pedidos_sheets(pedidos):
+    """Escribe uno o varios pedidos con un solo append por hoja y retorna las filas de Pedidos escritas.
+
+    Guarda en el almacén la fila de Sheets de cada pedido y de cada línea, para
+    luego actualizarlas sin buscar en la hoja. Cada hoja se registra apenas su
+    append responde, así el reintento de un lote que falló a medias solo agrega
+    lo que falta (por ejemplo, las líneas de Items de pedidos ya escritos en
+    Pedidos). Los pedidos marcados como `reenvio` (pendientes de antes de un
+    reinicio) se buscan además en la copia local de cada hoja: pudieron
+    escribirse justo antes de que el almacén alcanzara a registrarlos. Lanza la
+    excepción de gspread si falla; no muestra nada en pantalla.
+    """
+    almacen = obtener_almacen()
+    ubicaciones = almacen.filas_sheets([p["id"] for p in pedidos])
+    if any(p.get("reenvio") for p in pedidos):
+        # Las líneas sin registrar de esta app quedan después de la última fila de Items del índice
+        ultima_item = almacen.ultima_fila_sheets("Items")
+        recuperadas = []
+        for p in pedidos:
+            ubicacion = ubicaciones[p["id"]]
+            if not p.get("reenvio"):
+                continue
+            if ubicacion["Pedidos"] is None:
+                ubicacion["Pedidos"] = fila_en_hoja(p)
+                if ubicacion["Pedidos"] is None:
+                    continue
+                recuperadas.append((p["id"], "Pedidos", 0, ubicacion["Pedidos"]))
+            if p["productos"] and not ubicacion["Items"]:
+                filas = filas_items_en_hoja(p, ultima_item)
+                # Un append escribe todas las líneas del pedido o ninguna
+                if len(filas) >= len(p["productos"]):
+                    ubicacion["Items"] = filas[:len(p["productos"])]
+                    recuperadas += [(p["id"], "Items", orden, fila) for orden, fila in enumerate(ubicacion["Items"])]
+        if recuperadas:
+            almacen.guardar_filas_sheets(recuperadas)
+    escritas = []
+    sin_fila = [p for p in pedidos if ubicaciones[p["id"]]["Pedidos"] is None]
+    if sin_fila:
+        # Una sola llamada para todas las filas de Pedidos; la respuesta trae los valores escritos
+        respuesta = obtener_hoja_trabajo("Pedidos").append_rows(
+            [fila_pedido(p) for p in sin_fila], include_values_in_response=True
+        )
+        inicio = primera_fila(respuesta)
+        # Se registran antes de escribir Items: si ese append falla, el reintento no repite estas filas
+        almacen.guardar_filas_sheets([(p["id"], "Pedidos", 0, inicio + n) for n, p in enumerate(sin_fila)])
+        escritas = respuesta.get("updates", {}).get("updatedData", {}).get("values", [])
+    sin_items = [p for p in pedidos if p["productos"] and not ubicaciones[p["id"]]["Items"]]
+    if sin_items:
+        # Una sola llamada para todas las filas de Items
+        inicio = primera_fila(obtener_hoja_trabajo("Items").append_rows(
+            [fila for p in sin_items for fila in filas_items(p)]
+        ))
+        lineas = [(p["id"], orden) for p in sin_items for orden in range(len(p["productos"]))]
+        almacen.guardar_filas_sheets([(pedido_id, "Items", orden, inicio + n) for n, (pedido_id, orden) in enumerate(lineas)])
+    return escritas
+
+def sincronizar_cambios_sheets(limite=200):
+    """Envía a Sheets el estado actual de los pedidos modificados y retorna cuántos se enviaron.
+
+    Todas las filas cambiadas de Pedidos e Items van en una sola llamada
+    `values_batch_update`, ubicadas con el índice de filas del almacén. Las líneas
+    nuevas se agregan al final de Items y las que se quitaron quedan con
+    cantidad 0, así ninguna fila cambia de lugar.
+    """
+    almacen = obtener_almacen()
+    pedidos, marcas = almacen.cambios_pendientes(limite)
+    if not pedidos:
+        return 0
+    ubicaciones = almacen.filas_sheets([p["id"] for p in pedidos])
+    cambios = {"Pedidos": {}, "Items": {}}  # hoja -> {fila: valores}
+    nuevas, indice = [], []
+    for pedido in pedidos:
+        ubicacion = ubicaciones[pedido["id"]]
+        fila = ubicacion["Pedidos"]
+        if fila is None:
+            # Pedido escrito antes de existir el índice: se ubica una vez con la copia local de la hoja
+            fila = fila_en_hoja(pedido)
+            if fila is None:
+                continue
+            indice.append((pedido["id"], "Pedidos", 0, fila))
+        cambios["Pedidos"][fila] = fila_pedido(pedido)
+        if not ubicacion["Items"]:
+            # Sin filas de Items en el índice (pedido escrito antes de existir) no se puede saber cuáles son las suyas
+            continue
+        lineas = filas_items(pedido)
+        for orden, fila_item in enumerate(ubicacion["Items"]):
+            cambios["Items"][fila_item] = lineas[orden] if orden < len(lineas) else [pedido["id"], "", 0, "", 0]
+        nuevas += [(pedido["id"], orden, lineas[orden]) for orden in range(len(ubicacion["Items"]), len(lineas))]
+    if nuevas:
+        # El índice se guarda antes del batch: si este falla, el reintento reescribe las filas en vez de duplicarlas
+        inicio = primera_fila(obtener_hoja_trabajo("Items").append_rows([valores for _, _, valores in nuevas]))
+        indice += [(pedido_id, "Items", orden, inicio + n) for n, (pedido_id, orden, _) in enumerate(nuevas)]
+    if indice:
+        almacen.guardar_filas_sheets(indice)
+    datos = [
+        {"range": f"{hoja}!A{fila}:{gspread.utils.rowcol_to_a1(fila, len(valores))}", "values": [valores]}
+        for hoja, filas in cambios.items() for fila, valores in filas.items()
+    ]
+    if datos:
+        conectar_hoja().values_batch_update({"valueInputOption": "RAW", "data": datos})
+        for hoja, filas in cambios.items():
+            obtener_sincronizador().actualizar_filas(hoja, filas)
+    almacen.confirmar_cambios(marcas)
+    return len(pedidos)
+
+def leer_filas_sheets(nombre, desde_fila, cantidad, columnas):
+    """Lee `cantidad` filas de la hoja desde `desde_fila` con un rango A1, sin descargar la hoja completa.
+
+    Cada fila se completa con "" hasta `columnas` valores; una lista vacía indica
+    que no hay más filas.
+    """
+    ultima_col = gspread.utils.rowcol_to_a1(1, columnas).rstrip("0123456789")
+    filas = obtener_hoja_trabajo(nombre).get(
+        f"A{desde_fila}:{ultima_col}{desde_fila + cantidad - 1}",
+        value_render_option=gspread.utils.ValueRenderOption.unformatted
+    )
+    return [list(fila) + [""] * (columnas - len(fila)) for fila in filas]
+
+def importar_historial_sheets(bloque=200):
+    """Trae al almacén local el siguiente bloque de pedidos antiguos de las hojas Pedidos e Items.
+
+    Lee por rangos desde la última fila ya importada de cada hoja. Como ambas hojas
+    se escriben en el mismo orden, los ítems de cada pedido son las filas de Items
+    consecutivas con su id. En las filas que escribió esta app el índice de filas
+    dice a qué pedido pertenece cada línea, así los productos agregados después
+    (anexados al final de Items) se reconocen y se asignan a su pedido si está en
+    el mismo bloque. Retorna cuántos pedidos se importaron, o None si ya no
+    quedan filas por leer.
+    """
+    almacen = obtener_almacen()
+    fila_pedidos = almacen.cursor_hoja("Pedidos")
+    filas = leer_filas_sheets("Pedidos", fila_pedidos + 1, bloque, 8)
+    if not filas:
+        return None
+    propios = almacen.pedidos_en_filas("Pedidos", fila_pedidos + 1, fila_pedidos + len(filas))
+    fila_items = almacen.cursor_hoja("Items")
+    pendientes, leidas_items = [], fila_items
+    duenos, filas_duenos = {}, {}  # fila de Items -> pedido de la app; pedido -> su fila en Pedidos
+    pedidos, por_dueno = [], {}
+    for numero, fila in enumerate(filas, start=fila_pedidos + 1):
+        if not str(fila[0]).strip():
+            continue
+        pedido = {
+            "id": fila[0], "tipo": fila[1], "mesa": str(fila[2]) or None, "productos": [],
+            "hora": str(fila[3]), "estado": fila[4] or "Registrado",
+            "subtotal": float(fila[5] or 0), "propina": float(fila[6] or 0), "total": float(fila[7] or 0)
+        }
+        dueno = propios.get(numero)
+        while True:
+            if not pendientes:
+                pendientes = leer_filas_sheets("Items", leidas_items + 1, bloque * 4, 5)
+                if not pendientes:
+                    break
+                duenos.update(almacen.pedidos_en_filas("Items", leidas_items + 1, leidas_items + len(pendientes)))
+                ubicaciones = almacen.filas_sheets(list(set(duenos.values()) - set(filas_duenos)))
+                filas_duenos.update((i, u["Pedidos"]) for i, u in ubicaciones.items())
+                leidas_items += len(pendientes)
+            dueno_item = duenos.get(fila_items + 1)
+            if dueno_item is None:
+                # Fila sin índice: el pedido termina en la primera línea con otro id
+                if str(pendientes[0][0]) != str(pedido["id"]):
+                    break
+                destino = pedido
+            elif dueno_item == dueno:
+                destino = pedido
+            elif filas_duenos.get(dueno_item) is None or filas_duenos[dueno_item] < numero:
+                # Producto agregado después a un pedido anterior: se anexó al final de Items
+                destino = por_dueno.get(dueno_item)
+            else:
+                # Líneas de un pedido que aún no aparece en Pedidos
+                break
+            item = pendientes.pop(0)
+            fila_items += 1
+            if destino is not None and int(item[2] or 0) > 0:  # las líneas quitadas quedan con cantidad 0
+                destino["productos"].append({
+                    "nombre": item[1], "cantidad": int(item[2] or 0), "obs": str(item[3]), "subtotal": float(item[4] or 0)
+                })
+        pedidos.append(pedido)
+        if dueno is not None:
+            por_dueno[dueno] = pedido
+    return almacen.importar_pedidos(pedidos, {"Pedidos": fila_pedidos + len(filas), "Items": fila_items})
+
+# --- Copia local incremental de las hojas de Sheets ---
+RUTA_CACHE_HOJAS = os.environ.get("CAMPI_CACHE_HOJAS", RUTA_BD + "-hojas")
+
+class SincronizadorHojas:
+    """Mantiene una copia local por columnas (un DataFrame) de cada hoja de Sheets.
+
+    Cada hoja recuerda hasta qué fila ya fue leída; al sincronizar solo se piden las
+    filas nuevas con `batch_get` por rangos A1, así el costo depende de lo agregado
+    desde la última lectura y no del tamaño de la hoja. La copia se guarda en disco
+    para no volver a descargar todo al reiniciar la app. Supone hojas de solo
+    agregado, como Pedidos e Items.
+    """
+
+    def __init__(self, directorio=RUTA_CACHE_HOJAS, bloque=500, bloques_por_llamada=4):
+        self.directorio = directorio
+        self.bloque = bloque
+        self.bloques_por_llamada = bloques_por_llamada
+        self._lock = threading.Lock()
+        self._frames = {}
+        self.filas_nuevas = {}
+
+    def _ruta(self, nombre):
+        return os.path.join(self.directorio, f"{nombre}.pkl")
+
+    def _cargar(self, nombre):
+        """Retorna la copia en memoria, o la guardada en disco, o una vacía con los encabezados de la hoja."""
+        if nombre in self._frames:
+            return self._frames[nombre]
+        try:
+            df = pd.read_pickle(self._ruta(nombre))
+        except (OSError, ValueError, EOFError):
+            encabezados = obtener_hoja_trabajo(nombre).row_values(1)
+            df = pd.DataFrame(columns=encabezados)
+            if not encabezados:
+                # Hoja sin encabezados todavía: no se guarda para volver a intentarlo
+                return df
+        self._frames[nombre] = df
+        return df
+
+    def _guardar(self, nombre, df):
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            temporal = self._ruta(nombre) + ".tmp"
+            df.to_pickle(temporal)
+            os.replace(temporal, self._ruta(nombre))
+        except OSError:
+            # Sin disco la copia sigue sirviendo en memoria
+            pass
+
+    def sincronizar(self, nombre):
+        """Trae las filas nuevas de la hoja y retorna la copia completa como DataFrame."""
+        with self._lock:
+            self.filas_nuevas[nombre] = 0
+            df = self._cargar(nombre)
+            columnas = len(df.columns)
+            if not columnas:
+                return df
+            ultima_col = gspread.utils.rowcol_to_a1(1, columnas).rstrip("0123456789")
+            # Fila 1 son los encabezados; la copia tiene las filas 2..len(df)+1
+            siguiente = len(df) + 2
+            nuevas = []
+            while True:
+                rangos = [
+                    f"A{inicio}:{ultima_col}{inicio + self.bloque - 1}"
+                    for inicio in range(siguiente, siguiente + self.bloque * self.bloques_por_llamada, self.bloque)
+                ]
+                bloques = obtener_hoja_trabajo(nombre).batch_get(
+                    rangos, value_render_option=gspread.utils.ValueRenderOption.unformatted
+                )
+                completos = True
+                for filas in bloques:
+                    nuevas.extend(list(fila) + [""] * (columnas - len(fila)) for fila in filas)
+                    if len(filas) < self.bloque:
+                        completos = False
+                        break
+                if not completos:
+                    break
+                siguiente += self.bloque * self.bloques_por_llamada
+            self.filas_nuevas[nombre] = len(nuevas)
+            if nuevas:
+                agregado = pd.DataFrame(nuevas, columns=df.columns).infer_objects()
+                df = agregado if df.empty else pd.concat([df, agregado], ignore_index=True)
+                self._frames[nombre] = df
+                self._guardar(nombre, df)
+            return df
+
+    def actualizar_filas(self, nombre, filas):
+        """Aplica a la copia local filas que la app reescribió en Sheets: {número de fila: valores}."""
+        with self._lock:
+            df = self._frames.get(nombre)
+            filas = {fila: valores for fila, valores in filas.items() if df is not None and 2 <= fila < len(df) + 2}
+            if not filas:
+                return
+            # Las columnas pasan a object: una fila reescrita puede cambiar el tipo de una celda
+            df = df.astype(object)
+            for fila, valores in filas.items():
+                valores = list(valores)[:len(df.columns)]
+                df.iloc[fila - 2, :len(valores)] = valores
+            self._frames[nombre] = df
+            self._guardar(nombre, df)
+
+    def descartar(self, nombre=None):
+        """Olvida la copia local de una hoja (o de todas) para volver a leerla desde el principio."""
+        with self._lock:
+            for hoja in ([nombre] if nombre else list(self._frames)):
+                self._frames.pop(hoja, None)
+                try:
+                    os.remove(self._ruta(hoja))
+                except OSError:
+                    pass
+
+@st.cache_resource
+def obtener_sincronizador():
+    """Sincronizador único compartido por todas las sesiones."""
+    return SincronizadorHojas()
+
+# --- Cola de escritura diferida hacia Google Sheets ---
+class ColaEscritura:
+    """Acumula pedidos y los envía a Sheets en lote desde un hilo en segundo plano.
+
+    El envío se dispara al llegar a `max_lote` pedidos o cada `intervalo` segundos.
+    Los pedidos salen en el mismo orden en que entraron; si Sheets falla, el lote
+    se reintenta con espera exponencial sin perder ni reordenar pedidos. Si se
+    indica `actualizar`, cada `intervalo_cambios` segundos y sin pedidos nuevos
+    en espera se envían también los cambios de los pedidos ya escritos. Un error
+    inesperado queda en `ultimo_error` y el hilo sigue; `detener` lo termina.
+    """
+
+    def __init__(self, escribir, al_confirmar=None, max_lote=20, intervalo=2.0, espera_maxima=60.0,
+                 actualizar=None, intervalo_cambios=10.0):
+        self._escribir = escribir
+        self._al_confirmar = al_confirmar
+        self._actualizar = actualizar
+        self.intervalo_cambios = intervalo_cambios
+        self.max_lote = max_lote
+        self.intervalo = intervalo
+        self.espera_maxima = espera_maxima
+        self._pendientes = deque()
+        self._ids_pendientes = set()
+        self._cond = threading.Condition()
+        self.latencias = deque(maxlen=50)
+        self.enviados = 0
+        self.cambios_enviados = 0
+        self.reintentos = 0
+        self.ultimo_error = None
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(target=self._trabajar, name="cola-sheets", daemon=True)
+        self._hilo.start()
+
+    def detener(self, espera=30.0):
+        """Termina el hilo de envío tras el lote en curso; lo que quede en la cola se descarta."""
+        self._detener.set()
+        with self._cond:
+            self._cond.notify()
+        self._hilo.join(espera)
+
+    def encolar(self, pedido):
+        """Agrega una copia del pedido a la cola; retorna de inmediato.
+
+        Un pedido que ya está esperando en la cola no se agrega otra vez.
+        """
+        copia = dict(pedido, productos=[dict(item) for item in pedido["productos"]])
+        with self._cond:
+            if copia["id"] in self._ids_pendientes:
+                return
+            self._ids_pendientes.add(copia["id"])
+            self._pendientes.append(copia)
+            if len(self._pendientes) >= self.max_lote:
+                self._cond.notify()
+
+    def profundidad(self):
+        with self._cond:
+            return len(self._pendientes)
+
+    def latencia_promedio(self):
+        """Latencia promedio (segundos) de los últimos envíos exitosos."""
+        return sum(self.latencias) / len(self.latencias) if self.latencias else None
+
+    def _trabajar(self):
+        ultima_actualizacion = time.monotonic()
+        while not self._detener.is_set():
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: len(self._pendientes) >= self.max_lote or self._detener.is_set(), timeout=self.intervalo
+                )
+                lote = [self._pendientes[i] for i in range(min(self.max_lote, len(self._pendientes)))]
+            try:
+                if lote:
+                    self._enviar(lote)
+                elif self._actualizar and time.monotonic() - ultima_actualizacion >= self.intervalo_cambios:
+                    ultima_actualizacion = time.monotonic()
+                    self._enviar_cambios()
+            except Exception as e:
+                # P. ej. la base bloqueada al confirmar: el lote sigue en la cola y el índice de
+                # filas evita escribirlo dos veces en el próximo intento
+                self.ultimo_error = f"Error: {e}"
+                self._detener.wait(self.intervalo)
+
+    def _enviar_cambios(self):
+        # Los cambios quedan registrados en el almacén: si falla, se reintentan en el próximo ciclo
+        try:
+            self.cambios_enviados += self._actualizar()
+        except Exception as e:
+            self.ultimo_error = f"{'Modo local' if isinstance(e, CircuitoAbierto) else 'Error al enviar cambios'}: {e}"
+            return
+        self.ultimo_error = None
+
+    def _enviar(self, lote):
+        espera = 1.0
+        while not self._detener.is_set():
+            inicio = time.perf_counter()
+            try:
+                self._escribir(lote)
+            except CircuitoAbierto as e:
+                # Modo local: los pedidos ya están en el almacén; esperar a que Sheets vuelva
+                self.ultimo_error = f"Modo local: {e}"
+                self._detener.wait(min(e.restante, self.espera_maxima))
+                continue
+            except Exception as e:
+                # Límite de cuota o falla temporal: esperar y reintentar el mismo lote
+                self.ultimo_error = f"{'Límite de cuota' if es_limite_cuota(e) else 'Error'}: {e}"
+                self.reintentos += 1
+                self._detener.wait(espera)
+                espera = min(espera * 2, self.espera_maxima)
+                continue
+            self.latencias.append(time.perf_counter() - inicio)
+            self.enviados += len(lote)
+            if self._al_confirmar:
+                self._al_confirmar(lote)
+            self.ultimo_error = None
+            with self._cond:
+                for _ in lote:
+                    self._ids_pendientes.discard(self._pendientes.popleft()["id"])
+            return
+
+# Cola con el hilo de envío vivo; globals() la conserva si el módulo se recarga
+_cola_activa = globals().get("_cola_activa")
+
+@st.cache_resource
+def obtener_cola_escritura():
+    """Cola de escritura compartida por todas las sesiones del proceso.
+
+    Al iniciar, vuelve a encolar los pedidos del almacén local que no alcanzaron
+    a llegar a Sheets antes del último reinicio. Si ya había una cola (la caché se
+    limpió o el módulo se recargó), primero se detiene: dos hilos enviarían los
+    mismos pedidos.
+    """
+    global _cola_activa
+    if _cola_activa is not None:
+        _cola_activa.detener()
+    almacen = obtener_almacen()
+    cola = ColaEscritura(
+        escribir_pedidos_sheets,
+        al_confirmar=lambda lote: almacen.marcar_sincronizados([p["id"] for p in lote]),
+        actualizar=sincronizar_cambios_sheets
+    )
+    for pedido in almacen.pendientes_sincronizar():
+        cola.encolar(dict(pedido, reenvio=True))
+    _cola_activa = cola
+    return cola
+
+# --- Catálogo de productos ---
+CATEGORIAS_POR_DEFECTO = [
+    "Carnes Especiales", "Carnes", "Chuzos", "Arepas", "Hamburguesas",
+    "Perros", "Otros Platos", "Bebidas", "Jugos", "Limonadas"
+]
+PRODUCTOS_POR_DEFECTO = {
+    "punta de Anca con Champiñones": {"precio":20000, "descripcion":"Carne Asada, Papitas, arepa con lonchita, Ensalada", "categoria":"Carnes Especiales"},
+    "Solomito Especial": {"precio":50000, "descripcion":"Carne Asada, Papitas, arepa con lonchita, Ensalada", "categoria":"Carnes Especiales"},
+    "Punta de Anca": {"precio":15000, "descripcion":"Carne, papas, arepa", "categoria":"Carnes"},
+    "Chuzo de Pollo": {"precio":10000, "descripcion":"Chuzo, papas, arepa, Ensalada", "categoria":"Chuzos"},
+    "Arepa con Carne": {"precio":10000, "descripcion":"Carne desmechada y queso", "categoria":"Arepas"},
+    "Hamburguesa Especial": {"precio":10000, "descripcion":"Con todos los Juguetes", "categoria":"Hamburguesas"},
+    "Perro Grande Especial": {"precio":10000, "descripcion":"Ripio, Queso, Ensalada", "categoria":"Perros"},
+    "Picada para dos": {"precio":10000, "descripcion":"Picada de Chicharron, Papas, Morcilla, Carne, Maduritos", "categoria":"Otros Platos"},
+    "Cerveza": {"precio":5000, "descripcion":"Cerveza Fria", "categoria":"Bebidas"},
+    "Jugo de Mora": {"precio":10000, "descripcion":"Jugo Natural de Mora", "categoria":"Jugos"},
+    "Limonada de Mango": {"precio":5000, "descripcion":"Limonada de Mango", "categoria":"Limonadas"},
+    "Limonada de Coco": {"precio":5000, "descripcion":"Limonada de Coco", "categoria":"Limonadas"}
+}
+
+@st.cache_data(ttl=60, max_entries=1, show_spinner=False)
+def cargar_catalogo():
+    """Descarga la hoja Productos y retorna (revisión, productos, categorías).
+
+    Queda en caché hasta 60 s o hasta que las escrituras de la app llamen a
+    invalidar_catalogo(); las ediciones hechas a mano en la hoja se ven al vencer
+    el plazo. La revisión resume el contenido de Productos, así cada sesión
+    reconstruye su catálogo solo cuando el menú cambió.
+    """
+    filas_prod = obtener_hoja_trabajo("Productos").get_all_records()
+    revision = hash(json.dumps(filas_prod, sort_keys=True, default=str))
+    productos = {
+        fila["Nombre"]: {"precio": fila["Precio"], "descripcion": fila["Descripción"], "categoria": fila.get("Categoría")}
+        for fila in filas_prod
+    }
+    categorias = sorted({fila.get("Categoría") for fila in filas_prod if fila.get("Categoría")})
+    return revision, productos, categorias
+
+def invalidar_catalogo():
+    """Obliga a descargar el catálogo en el próximo rerun."""
+    cargar_catalogo.clear()
+
+class Catalogo:
+    """Productos del menú con un índice categoría → productos.
+
+    El índice se actualiza en cada alta, cambio o baja de productos y categorías,
+    así las páginas recorren solo los productos de cada categoría en lugar de
+    todo el menú una vez por categoría.
+    """
+
+    def __init__(self, productos, categorias, nuevas=()):
+        self.productos = {}
+        self.categorias = list(categorias)
+        self._por_categoria = {cat: {} for cat in self.categorias}
+        # Categorías creadas en esta sesión: mientras no tengan productos no existen en Sheets
+        self.nuevas = set()
+        for nombre, info in productos.items():
+            self.agregar_producto(nombre, info)
+        for categoria in nuevas:
+            self.agregar_categoria(categoria)
+
+    def productos_de(self, categoria):
+        """Productos de la categoría, como diccionario nombre → info."""
+        return self._por_categoria.get(categoria, {})
+
+    def buscar(self, texto):
+        """Productos cuyo nombre contiene `texto` (sin distinguir mayúsculas)."""
+        texto = texto.strip().lower()
+        return {nombre: info for nombre, info in self.productos.items() if texto in nombre.lower()}
+
+    def agregar_producto(self, nombre, info):
+        if nombre in self.productos:
+            self.eliminar_producto(nombre)
+        self.productos[nombre] = info
+        if info["categoria"]:
+            self._por_categoria.setdefault(info["categoria"], {})[nombre] = info
+
+    def actualizar_producto(self, nombre_anterior, nombre, info):
+        self.eliminar_producto(nombre_anterior)
+        self.agregar_producto(nombre, info)
+
+    def eliminar_producto(self, nombre):
+        info = self.productos.pop(nombre)
+        self._por_categoria.get(info["categoria"], {}).pop(nombre, None)
+
+    def sin_guardar(self):
+        """Categorías creadas en esta sesión que aún no tienen productos."""
+        return [cat for cat in self.categorias if cat in self.nuevas and not self.productos_de(cat)]
+
+    def agregar_categoria(self, categoria):
+        if categoria not in self.categorias:
+            self.categorias.append(categoria)
+            self.nuevas.add(categoria)
+        self._por_categoria.setdefault(categoria, {})
+
+    def renombrar_categoria(self, anterior, nueva):
+        """Renombra la categoría y retorna si hubo cambio; un nombre vacío lanza ValueError."""
+        if not nueva.strip():
+            raise ValueError("La categoría necesita un nombre")
+        if nueva == anterior:
+            return False
+        if nueva in self.categorias:
+            # Renombrar hacia una categoría existente equivale a fusionarlas
+            self.categorias.remove(anterior)
+        else:
+            self.categorias[self.categorias.index(anterior)] = nueva
+            if anterior in self.nuevas:
+                self.nuevas.add(nueva)
+        self.nuevas.discard(anterior)
+        movidos = self._por_categoria.pop(anterior, {})
+        for info in movidos.values():
+            info["categoria"] = nueva
+        self._por_categoria.setdefault(nueva, {}).update(movidos)
+        return True
+
+    def eliminar_categoria(self, categoria):
+        self.categorias.remove(categoria)
+        self.nuevas.discard(categoria)
+        for info in self._por_categoria.pop(categoria, {}).values():
+            info["categoria"] = None
+
+def guardar_producto_sheets(nombre, info, nombre_anterior=None):
+    """Crea o actualiza un producto en la hoja Productos e invalida el catálogo en caché."""
+    try:
+        hoja_prod = obtener_hoja_trabajo("Productos")
+        encabezados = hoja_prod.row_values(1)
+        valores = {"Nombre": nombre, "Precio": info["precio"], "Descripción": info["descripcion"], "Categoría": info["categoria"] or ""}
+        fila = [valores.get(col, "") for col in encabezados]
+        celda = hoja_prod.find(nombre_anterior or nombre, in_column=encabezados.index("Nombre") + 1)
+        if celda:
+            hoja_prod.update([fila], f"A{celda.row}")
+        else:
+            hoja_prod.append_row(fila)
+    except Exception as e:
+        st.warning(f"⚠️ El cambio quedó solo en esta sesión; no se pudo actualizar Sheets: {e}")
+        return False
+    invalidar_catalogo()
+    return True
+
+def eliminar_producto_sheets(nombre):
+    """Elimina un producto de la hoja Productos e invalida el catálogo en caché."""
+    try:
+        hoja_prod = obtener_hoja_trabajo("Productos")
+        col_nombre = hoja_prod.row_values(1).index("Nombre") + 1
+        celda = hoja_prod.find(nombre, in_column=col_nombre)
+        if celda:
+            hoja_prod.delete_rows(celda.row)
+    except Exception as e:
+        st.warning(f"⚠️ El cambio quedó solo en esta sesión; no se pudo actualizar Sheets: {e}")
+        return False
+    invalidar_catalogo()
+    return True
+
+def cambiar_categoria_sheets(anterior, nueva):
+    """Reemplaza la categoría `anterior` por `nueva` en todos los productos, en una sola escritura."""
+    try:
+        hoja_prod = obtener_hoja_trabajo("Productos")
+        col_cat = hoja_prod.row_values(1).index("Categoría") + 1
+        columna = hoja_prod.col_values(col_cat)
+        celdas = [
+            {"range": gspread.utils.rowcol_to_a1(fila, col_cat), "values": [[nueva or ""]]}
+            for fila, valor in enumerate(columna, start=1) if fila > 1 and valor == anterior
+        ]
+        if celdas:
+            hoja_prod.batch_update(celdas)
+    except Exception as e:
+        st.warning(f"⚠️ El cambio quedó solo en esta sesión; no se pudo actualizar Sheets: {e}")
+        return False
+    invalidar_catalogo()
+    return True